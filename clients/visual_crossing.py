@@ -9,15 +9,32 @@ Original file is located at
 
 import os
 import httpx
-import pandas as pd
-from pathlib import Path
-from datetime import date
+import time
+import random
+import unicodedata
+import importlib.util
 import asyncio
+from datetime import date
 from typing import Optional
+from urllib.parse import urlsplit
 
 VISUALCROSSING_API_KEY = os.getenv("VISUALCROSSING_API_KEY", "")
-DATA_DIR = Path("/weather")
-WEATHER_CSV = DATA_DIR / "daily_weather.csv"
+
+# cliente HTTP compartido (keep-alive) y límites frente al proveedor
+VC_TIMEOUT = float(os.getenv("VC_TIMEOUT", "30"))
+VC_MAX_CONNECTIONS = int(os.getenv("VC_MAX_CONNECTIONS", "10"))
+VC_MAX_PER_HOST = int(os.getenv("VC_MAX_PER_HOST", "4"))
+VC_MAX_RETRIES = int(os.getenv("VC_MAX_RETRIES", "3"))
+VC_BACKOFF_BASE = float(os.getenv("VC_BACKOFF_BASE", "0.5"))
+VC_BACKOFF_MAX = float(os.getenv("VC_BACKOFF_MAX", "10"))
+
+# circuit breaker: tras VC_BREAKER_FAILURES fallos seguidos no se llama al
+# proveedor durante VC_BREAKER_COOLDOWN segundos; luego se deja pasar una prueba
+VC_BREAKER_FAILURES = int(os.getenv("VC_BREAKER_FAILURES", "3"))
+VC_BREAKER_COOLDOWN = float(os.getenv("VC_BREAKER_COOLDOWN", "60"))
+
+_client: Optional[httpx.AsyncClient] = None
+_host_limits: dict[str, asyncio.Semaphore] = {}
 
 # dict citys
 CITY_ALIAS = {
@@ -29,12 +46,162 @@ CITY_ALIAS = {
     "SAN SEBASTIAN" : "San Sebastian, ES"
 }
 
-# columns we need
-WEATHER_COLUMNS = [
-    "city","date","tempmax","tempmin","temp",
-    "feelslikemax","feelslikemin","feelslike",
-    "precip","precipprob","conditions","icon","source"
-]
+class CircuitOpenError(RuntimeError):
+    """El proveedor está fallando y el circuit breaker corta la llamada."""
+
+class CircuitBreaker:
+    """closed -> open tras N fallos seguidos -> half_open (una llamada de prueba) tras el cooldown.
+
+    Vive en el event loop (sin locks): usar solo desde código async.
+    """
+
+    def __init__(self, failure_threshold: int = VC_BREAKER_FAILURES, cooldown: float = VC_BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_inflight = False
+        self.rejected = 0
+        self.opens = 0
+
+    def allow(self) -> bool:
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self._trial_inflight:
+            self._trial_inflight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._trial_inflight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_inflight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opens += 1
+                print(f"🚫 [visual_crossing] Circuit breaker abierto tras {self.failures} fallos")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """La llamada terminó sin veredicto (cancelada): libera el hueco de prueba."""
+        self._trial_inflight = False
+
+    def stats(self) -> dict:
+        retry_in = max(0.0, self.cooldown - (time.monotonic() - self.opened_at)) if self.state == "open" else 0.0
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_in_seconds": round(retry_in, 1),
+            "opens": self.opens,
+            "rejected": self.rejected,
+        }
+
+weather_breaker = CircuitBreaker()
+
+def _is_upstream_failure(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+# otros nombres con los que Visual Crossing o los CSV pueden devolver la ciudad
+CITY_EXTRA_NAMES = {
+    "DONOSTIA": "SAN SEBASTIAN",
+    "DONOSTIA SAN SEBASTIAN": "SAN SEBASTIAN",
+    "GASTEIZ": "VITORIA",
+    "IRUNA": "PAMPLONA",
+}
+
+def _city_key(name: str) -> str:
+    """'Vitoria-Gasteiz, ES' -> 'VITORIA GASTEIZ' (sin acentos, sin país/provincia)."""
+    name = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode()
+    name = name.split(",")[0].replace("-", " ").replace("/", " ")
+    return " ".join(name.upper().split())
+
+_VENUE_BY_CITY = {
+    **{_city_key(name): venue for name, venue in CITY_EXTRA_NAMES.items()},
+    **{_city_key(city): venue for venue, city in CITY_ALIAS.items()},
+    **{_city_key(venue): venue for venue in CITY_ALIAS},
+}
+
+def venue_for_city(city: Optional[str]) -> Optional[str]:
+    """Venue canónico ('PAMPLONA') para un venue o nombre de ciudad; None si no es de ningún venue."""
+    if not city:
+        return None
+    key = _city_key(city)
+    if key in _VENUE_BY_CITY:
+        return _VENUE_BY_CITY[key]
+    return next((venue for name, venue in _VENUE_BY_CITY.items() if name in key), None)
+
+def venue_key(city: Optional[str]) -> Optional[str]:
+    """Venue canónico, o el nombre normalizado si la ciudad no es de ningún venue ('Madrid' -> 'MADRID')."""
+    if not city:
+        return None
+    return venue_for_city(city) or _city_key(city)
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+def get_client() -> httpx.AsyncClient:
+    """Cliente de vida de la app (se crea bajo demanda si no lo abrió el lifespan)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=VC_TIMEOUT,
+            http2=_http2_available(),
+            limits=httpx.Limits(max_connections=VC_MAX_CONNECTIONS,
+                                max_keepalive_connections=VC_MAX_CONNECTIONS,
+                                keepalive_expiry=60),
+        )
+    return _client
+
+async def close_client():
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
+
+def _retry_delay(attempt: int, response: Optional[httpx.Response]) -> float:
+    # respeta Retry-After en 429; si no, backoff exponencial con jitter completo
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), VC_BACKOFF_MAX)
+    return random.uniform(0, min(VC_BACKOFF_MAX, VC_BACKOFF_BASE * 2 ** attempt))
+
+async def _get_json(url: str, params: dict):
+    """GET con el cliente compartido, máximo VC_MAX_PER_HOST en vuelo por host y reintentos en 429/5xx."""
+    client = get_client()
+    host = urlsplit(url).netloc
+    limit = _host_limits.setdefault(host, asyncio.Semaphore(VC_MAX_PER_HOST))
+
+    for attempt in range(VC_MAX_RETRIES + 1):
+        response = None
+        async with limit:
+            try:
+                response = await client.get(url, params=params)
+            except httpx.TransportError as e:
+                error = e
+            else:
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    return response.json()
+                error = httpx.HTTPStatusError(
+                    f"{response.status_code} de {host}", request=response.request, response=response)
+
+        if attempt == VC_MAX_RETRIES:
+            raise error
+        delay = _retry_delay(attempt, response)
+        print(f"🔁 [visual_crossing] {error!r}; reintento {attempt + 1}/{VC_MAX_RETRIES} en {delay:.1f}s")
+        await asyncio.sleep(delay)
 
 async def fetch_weather_for_city(city_alias: str, start_date:str, end_date:Optional[str]=None):
     """Llama a Visual Crossing para city_alias (ej. 'Vitoria-Gasteiz') entre start_date y end_date"""
@@ -51,56 +218,47 @@ async def fetch_weather_for_city(city_alias: str, start_date:str, end_date:Optio
         
     params = {"unitGroup": "metric", "key": VISUALCROSSING_API_KEY, "include": "current,days"}
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.get(url, params=params)
-        r.raise_for_status()
-        payload = r.json()
+    if not weather_breaker.allow():
+        raise CircuitOpenError(f"Visual Crossing no disponible (circuit breaker abierto) para {city_alias}")
+    try:
+        payload = await _get_json(url, params)
+    except Exception as e:
+        if _is_upstream_failure(e):
+            weather_breaker.record_failure()
+        else:
+            weather_breaker.record_success()  # el proveedor respondió (p. ej. 400 por ciudad inválida)
+        raise
+    except BaseException:
+        weather_breaker.release()
+        raise
+    weather_breaker.record_success()
 
     days = payload.get("days", [])
     rows= []
     curr = payload.get("currentConditions", {}) or {}
+    today = date.today().isoformat()
 
     for day in days:
+        day_str = day.get("datetime") or today
+        # currentConditions solo describe hoy: el resto de días usan su propio pronóstico
+        current = curr if day_str == today else {}
         # Build the row in CSV (con fallback a current)
         rows.append({
             "city": payload.get("address") or payload.get("resolvedAddress") or city_alias,
-            "date": day.get("datetime") or date.today().isoformat(),
+            "date": day_str,
             "tempmax": day.get("tempmax"),
             "tempmin": day.get("tempmin"),
-            "temp": day.get("temp") if day.get("temp") is not None else curr.get("temp"),
+            "temp": day.get("temp") if day.get("temp") is not None else current.get("temp"),
             "feelslikemax": day.get("feelslikemax"),
             "feelslikemin": day.get("feelslikemin"),
-            "feelslike": day.get("feelslike") if day.get("feelslike") is not None else curr.get("feelslike"),
+            "feelslike": day.get("feelslike") if day.get("feelslike") is not None else current.get("feelslike"),
             "precip": day.get("precip"),
             "precipprob": day.get("precipprob"),
-            "conditions": (curr.get("conditions") or day.get("conditions")),
-            "icon": (curr.get("icon") or day.get("icon")),
+            "conditions": (current.get("conditions") or day.get("conditions")),
+            "icon": (current.get("icon") or day.get("icon")),
             "source": "visualcrossing",
+            "venue": venue_for_city(city_alias),
         })
         
     print(f"✅ [fetch_weather_for_city] Construidos {len(rows)} rows para {city_alias}")
     return rows
-
-async def upsert_daily_weather_csv_async(row: dict):
-    await asyncio.to_thread(upsert_daily_weather_csv, row)
-
-def upsert_daily_weather_csv(row: dict):
-    """Upsert por (city, date) en data/synthetic_daily_weather.csv"""
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-
-    if WEATHER_CSV.exists():
-        df = pd.read_csv(WEATHER_CSV)
-    else:
-        df = pd.DataFrame(columns=WEATHER_COLUMNS)
-
-    # Delete if exist (city,date)
-    df = df[~((df["city"] == row["city"]) & (df["date"] == row["date"]))]
-
-    missing = [c for c in WEATHER_COLUMNS if c not in df.columns]
-    if missing:
-        for c in missing:
-            df[c] = None
-
-    df = pd.concat([df, pd.DataFrame([row])[WEATHER_COLUMNS]], ignore_index=True)
-    df.to_csv(WEATHER_CSV, index=False)
-    print(f"✅ [upsert] Escrito row: {row['city']} {row['date']} — total filas ahora: {len(df)}")
@@ -9,11 +9,57 @@ Original file is located at
 
 import psycopg2
 import os
+import re
+import time
+import uuid
+import asyncio
+import threading
+from datetime import date
+from decimal import Decimal
+from itertools import islice
+from collections import deque
+from contextlib import contextmanager
+from psycopg2 import errors, sql
 from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as _PgConnection
 from dotenv import load_dotenv
 
+try:
+  import asyncpg
+except ImportError:  # solo hace falta con DB_BACKEND=asyncpg
+  asyncpg = None
+
 load_dotenv()
 
+# "psycopg2" (por defecto, en threads) o "asyncpg" (nativo async)
+DB_BACKEND = os.getenv("DB_BACKEND", "psycopg2").strip().lower()
+
+# pool config (segundos para los tiempos)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+DB_POOL_HEALTHCHECK_AFTER = float(os.getenv("DB_POOL_HEALTHCHECK_AFTER", "30"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+# filas por viaje al servidor en los cursores de servidor (streaming / paginado)
+DB_STREAM_BATCH_SIZE = int(os.getenv("DB_STREAM_BATCH_SIZE", "1000"))
+
+# ajustes de sesión: se envían al abrir cada conexión (sin round trips extra por consulta)
+SESSION_SETTINGS = {
+    "search_path": "dwh,public",
+    "statement_timeout": os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"),
+    "lock_timeout": os.getenv("DB_LOCK_TIMEOUT_MS", "5000"),
+    "idle_in_transaction_session_timeout": os.getenv("DB_IDLE_IN_TX_TIMEOUT_MS", "60000"),
+    "application_name": os.getenv("DB_APPLICATION_NAME", "botpress_sql_backend"),
+}
+
+class SessionConnection(_PgConnection):
+  """Conexión psycopg2 que recuerda qué statements tiene preparados en su sesión."""
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.prepared = set()
+
 def fn_get_connection():
   return psycopg2.connect(
       host=os.getenv("DB_HOST"),
@@ -21,6 +67,382 @@ def fn_get_connection():
       database=os.getenv("DB_NAME"),
       user=os.getenv("DB_USER"),
       password=os.getenv("DB_PASSWORD"),
-      options='-c search_path=dwh,public',
+      options=" ".join(f"-c {key}={value}" for key, value in SESSION_SETTINGS.items()),
+      connection_factory=SessionConnection,
       cursor_factory=RealDictCursor
   )
+
+class PoolTimeout(RuntimeError):
+  pass
+
+class ConnectionPool:
+  """Pool de conexiones psycopg2 thread-safe.
+
+  - abre como mucho `max_size` conexiones y mantiene al menos `min_size` abiertas
+  - hace un `SELECT 1` antes de prestar una conexión que lleva más de
+    `healthcheck_after` segundos parada
+  - cierra las conexiones que llevan más de `max_idle` segundos sin usarse
+  - al devolverla hace rollback; si la conexión está rota se descarta
+  """
+
+  def __init__(self, connect=fn_get_connection, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+               max_idle=DB_POOL_MAX_IDLE, healthcheck_after=DB_POOL_HEALTHCHECK_AFTER, timeout=DB_POOL_TIMEOUT):
+    self.connect = connect
+    self.min_size = min_size
+    self.max_size = max(max_size, 1)
+    self.max_idle = max_idle
+    self.healthcheck_after = healthcheck_after
+    self.timeout = timeout
+    self._idle = deque()  # (conn, last_used)
+    self._size = 0        # conexiones abiertas: ociosas + prestadas
+    self._cond = threading.Condition()
+    self._closed = False
+
+  def open(self):
+    """Abre las `min_size` conexiones iniciales."""
+    while True:
+      with self._cond:
+        if self._closed or self._size >= self.min_size:
+          return
+        self._size += 1
+      try:
+        conn = self.connect()
+      except Exception:
+        self._release_slot()
+        raise
+      with self._cond:
+        self._idle.append((conn, time.monotonic()))
+        self._cond.notify()
+
+  def getconn(self):
+    deadline = time.monotonic() + self.timeout
+    while True:
+      conn, idle_for = self._checkout(deadline)
+      if conn is None:
+        # tenemos hueco reservado: conexión nueva
+        try:
+          return self.connect()
+        except Exception:
+          self._release_slot()
+          raise
+      if idle_for > self.healthcheck_after and not self._is_alive(conn):
+        self._discard(conn)
+        continue
+      return conn
+
+  def putconn(self, conn):
+    if conn.closed:
+      self._discard(conn)
+      return
+    try:
+      if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+    except Exception:
+      self._discard(conn)
+      return
+    with self._cond:
+      if self._closed:
+        self._size -= 1
+        to_close = conn
+      else:
+        self._idle.append((conn, time.monotonic()))
+        to_close = None
+      self._cond.notify()
+    if to_close is not None:
+      self._close_quietly(to_close)
+
+  def close(self):
+    with self._cond:
+      self._closed = True
+      idle = [conn for conn, _ in self._idle]
+      self._idle.clear()
+      self._size -= len(idle)
+      self._cond.notify_all()
+    for conn in idle:
+      self._close_quietly(conn)
+
+  def stats(self):
+    with self._cond:
+      return {"size": self._size, "idle": len(self._idle), "min_size": self.min_size, "max_size": self.max_size}
+
+  def _checkout(self, deadline):
+    """Devuelve (conn, segundos_ociosa) o (None, 0) si se ha reservado hueco para una conexión nueva."""
+    expired = []
+    try:
+      with self._cond:
+        while True:
+          if self._closed:
+            raise RuntimeError("Connection pool cerrado")
+          now = time.monotonic()
+          self._collect_expired(now, expired)
+          if self._idle:
+            conn, last_used = self._idle.pop()  # LIFO: la más reciente está caliente
+            return conn, now - last_used
+          if self._size < self.max_size:
+            self._size += 1
+            return None, 0
+          remaining = deadline - now
+          if remaining <= 0:
+            raise PoolTimeout(f"No hay conexiones libres tras {self.timeout}s (max_size={self.max_size})")
+          self._cond.wait(remaining)
+    finally:
+      for conn in expired:
+        self._close_quietly(conn)
+
+  def _collect_expired(self, now, expired):
+    # las más antiguas están al principio de la cola
+    while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.max_idle:
+      conn, _ = self._idle.popleft()
+      self._size -= 1
+      expired.append(conn)
+
+  def _is_alive(self, conn):
+    try:
+      with conn.cursor() as cur:
+        cur.execute("SELECT 1")
+      conn.rollback()
+      return True
+    except Exception:
+      return False
+
+  def _discard(self, conn):
+    self._close_quietly(conn)
+    self._release_slot()
+
+  def _release_slot(self):
+    with self._cond:
+      self._size -= 1
+      self._cond.notify()
+
+  @staticmethod
+  def _close_quietly(conn):
+    try:
+      conn.close()
+    except Exception:
+      pass
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+  global _pool
+  with _pool_lock:
+    if _pool is None:
+      _pool = ConnectionPool()
+    return _pool
+
+def open_pool():
+  get_pool().open()
+
+def close_pool():
+  global _pool
+  with _pool_lock:
+    pool, _pool = _pool, None
+  if pool is not None:
+    pool.close()
+
+@contextmanager
+def pooled_connection():
+  """Presta una conexión del pool y la devuelve siempre, también si hay excepción."""
+  pool = get_pool()
+  conn = pool.getconn()
+  try:
+    yield conn
+  finally:
+    pool.putconn(conn)
+
+_FUNCTION_NAME = re.compile(r"^[a-z_][a-z0-9_]{0,58}$")
+
+def _check_function_name(fn_name):
+  # solo identificadores simples: el nombre nunca llega al SQL sin validar
+  if not isinstance(fn_name, str) or not _FUNCTION_NAME.match(fn_name):
+    raise ValueError(f"Nombre de función no válido: {fn_name!r}")
+
+def _prepare(conn, cur, fn_name, name, n_args):
+  params = sql.SQL(", ").join(sql.SQL(f"${i}") for i in range(1, n_args + 1))
+  cur.execute(sql.SQL("PREPARE {} AS SELECT * FROM {}.{}({})").format(
+      sql.Identifier(name), sql.Identifier("dwh"), sql.Identifier(fn_name), params))
+  conn.prepared.add(name)
+
+def execute_prepared(conn, fn_name, args):
+  """EXECUTE del statement preparado de dwh.<fn_name> en esta conexión (se prepara en el primer uso)."""
+  _check_function_name(fn_name)
+  name = f"kpi_{fn_name}"
+  args = list(args)
+  execute = sql.SQL("EXECUTE {}").format(sql.Identifier(name))
+  if args:
+    execute += sql.SQL(" ({})").format(sql.SQL(", ").join(sql.Placeholder() * len(args)))
+
+  for attempt in range(2):
+    try:
+      with conn.cursor() as cur:
+        if name not in conn.prepared:
+          _prepare(conn, cur, fn_name, name, len(args))
+        cur.execute(execute, args)
+        return cur.fetchall()
+    except (errors.InvalidSqlStatementName, errors.FeatureNotSupported) as e:
+      # el statement ya no existe o la función cambió de tipo de resultado: se vuelve a preparar
+      conn.rollback()
+      if attempt:
+        raise
+      if isinstance(e, errors.FeatureNotSupported) and name in conn.prepared:
+        with conn.cursor() as cur:
+          cur.execute(sql.SQL("DEALLOCATE {}").format(sql.Identifier(name)))
+      conn.prepared.discard(name)
+
+def fetch_prepared(fn_name, args):
+  """execute_prepared con una conexión del pool (bloqueante: llamar vía asyncio.to_thread)."""
+  with pooled_connection() as conn:
+    return execute_prepared(conn, fn_name, args)
+
+def _function_select(fn_name, n_args):
+  params = sql.SQL(", ").join(sql.Placeholder() * n_args)
+  return sql.SQL("SELECT * FROM {}.{}({})").format(sql.Identifier("dwh"), sql.Identifier(fn_name), params)
+
+def iter_function_rows(fn_name, args, offset=0, batch_size=DB_STREAM_BATCH_SIZE):
+  """Generador de filas de dwh.<fn_name> con un cursor de servidor (bloqueante).
+
+  Trae `batch_size` filas por viaje, así que la memoria no depende del tamaño
+  del resultado. La conexión vuelve al pool al agotar o cerrar el generador.
+  """
+  _check_function_name(fn_name)
+  with pooled_connection() as conn:
+    with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cur:
+      cur.itersize = batch_size
+      cur.execute(_function_select(fn_name, len(args)), list(args))
+      if offset:
+        cur.scroll(offset)
+      yield from cur
+
+def fetch_function_page(fn_name, args, offset, limit):
+  """Hasta limit + 1 filas desde offset (la fila extra indica si hay más); bloqueante."""
+  rows = iter_function_rows(fn_name, args, offset, batch_size=min(limit + 1, DB_STREAM_BATCH_SIZE))
+  try:
+    return list(islice(rows, limit + 1))
+  finally:
+    rows.close()
+
+_async_pool = None
+_async_pool_lock = asyncio.Lock()
+
+async def get_async_pool():
+  global _async_pool
+  if _async_pool is not None:
+    return _async_pool
+  async with _async_pool_lock:
+    if _async_pool is None:
+      if asyncpg is None:
+        raise RuntimeError("DB_BACKEND=asyncpg pero asyncpg no está instalado")
+      _async_pool = await asyncpg.create_pool(
+          host=os.getenv("DB_HOST"),
+          port=int(os.getenv("DB_PORT") or 5432),
+          database=os.getenv("DB_NAME"),
+          user=os.getenv("DB_USER"),
+          password=os.getenv("DB_PASSWORD"),
+          min_size=DB_POOL_MIN_SIZE,
+          max_size=DB_POOL_MAX_SIZE,
+          max_inactive_connection_lifetime=DB_POOL_MAX_IDLE,
+          timeout=DB_POOL_TIMEOUT,
+          server_settings=SESSION_SETTINGS,
+      )
+    return _async_pool
+
+async def open_db():
+  if DB_BACKEND == "asyncpg":
+    await get_async_pool()
+  else:
+    await asyncio.to_thread(open_pool)
+
+async def close_db():
+  global _async_pool
+  async with _async_pool_lock:
+    pool, _async_pool = _async_pool, None
+  if pool is not None:
+    await pool.close()
+  await asyncio.to_thread(close_pool)
+
+async def fetch_function(fn_name, args):
+  """SELECT * FROM dwh.<fn_name>(args) con el backend configurado; devuelve lista de dicts.
+
+  Con psycopg2 cada conexión prepara la llamada en su primer uso y luego
+  solo hace EXECUTE; asyncpg ya guarda los statements preparados por
+  conexión en su propia caché.
+  """
+  _check_function_name(fn_name)
+  if DB_BACKEND == "asyncpg":
+    pool = await get_async_pool()
+    async with pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+      query = _asyncpg_select(fn_name, len(args))
+      rows = await conn.fetch(query, *await _asyncpg_args(conn, query, args))
+    return [dict(row) for row in rows]
+
+  return await asyncio.to_thread(fetch_prepared, fn_name, args)
+
+def _asyncpg_select(fn_name, n_args):
+  placeholders = ", ".join(f"${i}" for i in range(1, n_args + 1))
+  return f'SELECT * FROM dwh."{fn_name}"({placeholders})'
+
+_PG_INTEGER = {"int2", "int4", "int8"}
+_PG_FLOAT = {"float4", "float8"}
+_PG_TEXT = {"text", "varchar", "bpchar", "name"}
+
+def _asyncpg_arg(type_name, value):
+  if value is None:
+    return None
+  if type_name in _PG_TEXT:
+    return value if isinstance(value, str) else str(value)
+  if isinstance(value, str):
+    value = value.strip()
+    if type_name in _PG_INTEGER:
+      return int(value)
+    if type_name in _PG_FLOAT:
+      return float(value)
+    if type_name == "numeric":
+      return Decimal(value)
+    if type_name == "date":
+      return date.fromisoformat(value)
+  elif type_name in _PG_INTEGER and isinstance(value, float) and value.is_integer():
+    return int(value)
+  return value
+
+# tipos de los $n de cada SELECT, sacados del servidor la primera vez (no cambian entre conexiones)
+_asyncpg_param_types = {}
+
+async def _asyncpg_args(conn, query, args):
+  """Args convertidos al tipo de cada $n: asyncpg no convierte como psycopg2 (p. ej. "2024" para un int)."""
+  types = _asyncpg_param_types.get(query)
+  if types is None:
+    stmt = await conn.prepare(query)
+    types = _asyncpg_param_types[query] = [param.name for param in stmt.get_parameters()]
+  return [_asyncpg_arg(type_name, value) for type_name, value in zip(types, args)]
+
+async def fetch_function_page_async(fn_name, args, offset, limit):
+  """fetch_function_page con el backend configurado; devuelve lista de dicts."""
+  _check_function_name(fn_name)
+  if DB_BACKEND != "asyncpg":
+    return await asyncio.to_thread(fetch_function_page, fn_name, args, offset, limit)
+  pool = await get_async_pool()
+  async with pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+    async with conn.transaction():
+      query = _asyncpg_select(fn_name, len(args))
+      cur = await conn.cursor(query, *await _asyncpg_args(conn, query, args))
+      if offset:
+        await cur.forward(offset)
+      rows = await cur.fetch(limit + 1)
+  return [dict(row) for row in rows]
+
+async def _iter_function_rows_async(fn_name, args):
+  pool = await get_async_pool()
+  async with pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+    async with conn.transaction():
+      query = _asyncpg_select(fn_name, len(args))
+      async for row in conn.cursor(query, *await _asyncpg_args(conn, query, args), prefetch=DB_STREAM_BATCH_SIZE):
+        yield dict(row)
+
+def stream_function(fn_name, args):
+  """Filas de dwh.<fn_name> por lotes: generador síncrono con psycopg2 (para ejecutar en
+  un thread) o asíncrono con asyncpg."""
+  _check_function_name(fn_name)
+  if DB_BACKEND == "asyncpg":
+    return _iter_function_rows_async(fn_name, args)
+  return iter_function_rows(fn_name, args)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Backfill / refresco de clima por rangos de fechas.
+
+1. Para cada venue mira en el weather store qué fechas del rango faltan o
+   están caducadas (previsiones descargadas hace más de
+   WEATHER_FORECAST_MAX_AGE_HOURS).
+2. Junta esas fechas en ventanas contiguas por ciudad, partidas en trozos
+   de como mucho `max_window_days` días.
+3. Pide cada ventana a Visual Crossing una sola vez y guarda sus filas en
+   un solo upsert.
+
+Cada job y sus ventanas quedan apuntados en el mismo SQLite del weather
+store, así que se puede consultar el progreso y relanzar un job con su
+job_id: solo se repiten las ventanas que no terminaron.
+"""
+
+import os
+import uuid
+import asyncio
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from clients.visual_crossing import CITY_ALIAS, fetch_weather_for_city
+from ingest.daily import DEFAULT_VENUES
+from store.weather import weather_store
+
+MAX_WINDOW_DAYS = int(os.getenv("WEATHER_BACKFILL_MAX_WINDOW_DAYS", "30"))
+BACKFILL_CONCURRENCY = int(os.getenv("WEATHER_BACKFILL_CONCURRENCY", "4"))
+WEATHER_FORECAST_MAX_AGE_HOURS = float(os.getenv("WEATHER_FORECAST_MAX_AGE_HOURS", "6"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS weather_backfill_jobs (
+    job_id TEXT PRIMARY KEY, created_at TEXT, updated_at TEXT, status TEXT,
+    start_date TEXT, end_date TEXT, venues TEXT
+);
+CREATE TABLE IF NOT EXISTS weather_backfill_windows (
+    job_id TEXT, city TEXT, start_date TEXT, end_date TEXT,
+    status TEXT, rows INTEGER DEFAULT 0, error TEXT, updated_at TEXT,
+    PRIMARY KEY (job_id, city, start_date)
+);
+"""
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+def _journal():
+    conn = weather_store.connect()
+    conn.executescript(_SCHEMA)
+    return conn
+
+# --- planificación ---
+
+def is_fresh(date_str: str, fetched_at: Optional[str], now: Optional[datetime] = None) -> bool:
+    """Una fila vale si ya era histórica al descargarla o si su previsión es reciente."""
+    now = now or datetime.now()
+    if fetched_at is None:
+        # importada del CSV antiguo: solo el histórico se da por definitivo
+        return date_str < now.date().isoformat()
+    if date_str < fetched_at[:10]:
+        return True
+    return datetime.fromisoformat(fetched_at) >= now - timedelta(hours=WEATHER_FORECAST_MAX_AGE_HOURS)
+
+def missing_dates(venue: str, start: date, end: date) -> list[date]:
+    stored = weather_store.fetched_dates(venue, start.isoformat(), end.isoformat())
+    now = datetime.now()
+    days = (start + timedelta(days=i) for i in range((end - start).days + 1))
+    return [d for d in days if not (d.isoformat() in stored and is_fresh(d.isoformat(), stored[d.isoformat()], now))]
+
+def merge_windows(dates: list[date], max_window_days: int = MAX_WINDOW_DAYS) -> list[tuple[date, date]]:
+    """Fechas sueltas -> ventanas contiguas [inicio, fin] de como mucho max_window_days."""
+    windows = []
+    for d in sorted(set(dates)):
+        if windows:
+            start, end = windows[-1]
+            if d == end + timedelta(days=1) and (d - start).days < max_window_days:
+                windows[-1] = (start, d)
+                continue
+        windows.append((d, d))
+    return windows
+
+def plan_backfill(venues: list[str], start: date, end: date,
+                  max_window_days: int = MAX_WINDOW_DAYS) -> list[tuple[str, date, date]]:
+    plan = []
+    for venue in venues:
+        city = CITY_ALIAS.get(venue, venue)
+        for window_start, window_end in merge_windows(missing_dates(venue, start, end), max_window_days):
+            plan.append((city, window_start, window_end))
+    return plan
+
+# --- journal de jobs ---
+
+def _create_job(venues, start: date, end: date, plan) -> str:
+    job_id = uuid.uuid4().hex[:12]
+    now = _now()
+    with weather_store.write() as conn:
+        conn.execute(
+            "INSERT INTO weather_backfill_jobs VALUES (?, ?, ?, 'pending', ?, ?, ?)",
+            (job_id, now, now, start.isoformat(), end.isoformat(), ",".join(venues)))
+        conn.executemany(
+            "INSERT INTO weather_backfill_windows (job_id, city, start_date, end_date, status, updated_at) "
+            "VALUES (?, ?, ?, ?, 'pending', ?)",
+            [(job_id, city, ws.isoformat(), we.isoformat(), now) for city, ws, we in plan])
+    return job_id
+
+def _pending_windows(job_id: str) -> list[tuple[str, str, str]]:
+    rows = _journal().execute(
+        "SELECT city, start_date, end_date FROM weather_backfill_windows "
+        "WHERE job_id = ? AND status != 'done' ORDER BY city, start_date", (job_id,)).fetchall()
+    return [(row["city"], row["start_date"], row["end_date"]) for row in rows]
+
+def _mark_window(job_id, city, start_date, status, rows=0, error=None):
+    with weather_store.write() as conn:
+        conn.execute(
+            "UPDATE weather_backfill_windows SET status = ?, rows = ?, error = ?, updated_at = ? "
+            "WHERE job_id = ? AND city = ? AND start_date = ?",
+            (status, rows, error, _now(), job_id, city, start_date))
+
+def _mark_job(job_id, status):
+    with weather_store.write() as conn:
+        conn.execute("UPDATE weather_backfill_jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+                     (status, _now(), job_id))
+
+def backfill_status(job_id: str) -> Optional[dict]:
+    conn = _journal()
+    job = conn.execute("SELECT * FROM weather_backfill_jobs WHERE job_id = ?", (job_id,)).fetchone()
+    if job is None:
+        return None
+    windows = [dict(row) for row in conn.execute(
+        "SELECT city, start_date, end_date, status, rows, error FROM weather_backfill_windows "
+        "WHERE job_id = ? ORDER BY city, start_date", (job_id,))]
+    done = sum(1 for w in windows if w["status"] == "done")
+    return {
+        **dict(job),
+        "windows_total": len(windows),
+        "windows_done": done,
+        "windows_failed": sum(1 for w in windows if w["status"] == "failed"),
+        "rows_upserted": sum(w["rows"] or 0 for w in windows),
+        "progress": round(done / len(windows), 3) if windows else 1.0,
+        "windows": windows,
+    }
+
+# --- ejecución ---
+
+async def _run_window(job_id, city, start_date, end_date, limit):
+    async with limit:
+        await asyncio.to_thread(_mark_window, job_id, city, start_date, "running")
+        try:
+            rows = await fetch_weather_for_city(city, start_date, end_date)
+            upserted = await asyncio.to_thread(weather_store.upsert_many, rows)
+        except Exception as e:
+            print(f"❌ [backfill] {city} {start_date}..{end_date}: {e}")
+            await asyncio.to_thread(_mark_window, job_id, city, start_date, "failed", 0, str(e))
+            return False
+        await asyncio.to_thread(_mark_window, job_id, city, start_date, "done", upserted)
+        print(f"📥 [backfill] {city} {start_date}..{end_date}: {upserted} filas")
+        return True
+
+async def create_backfill_job(venues: Optional[list[str]] = None, start_date: Optional[str] = None,
+                              end_date: Optional[str] = None, max_window_days: int = MAX_WINDOW_DAYS) -> str:
+    """Planifica las ventanas que faltan y las apunta como un job nuevo."""
+    venues = venues or DEFAULT_VENUES
+    start = date.fromisoformat(start_date) if start_date else date.today()
+    end = date.fromisoformat(end_date) if end_date else start
+    await asyncio.to_thread(_journal)
+    plan = await asyncio.to_thread(plan_backfill, venues, start, end, max_window_days)
+    job_id = await asyncio.to_thread(_create_job, venues, start, end, plan)
+    print(f"🗓️ [backfill] Job {job_id}: {len(plan)} ventanas para {len(venues)} venues ({start}..{end})")
+    return job_id
+
+async def run_backfill_job(job_id: str) -> Optional[dict]:
+    """Ejecuta (o reanuda) las ventanas pendientes o fallidas del job."""
+    pending = await asyncio.to_thread(_pending_windows, job_id)
+    await asyncio.to_thread(_mark_job, job_id, "running")
+    limit = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+    results = await asyncio.gather(*(_run_window(job_id, city, ws, we, limit) for city, ws, we in pending))
+    await asyncio.to_thread(_mark_job, job_id, "done" if all(results) else "partial")
+    return await asyncio.to_thread(backfill_status, job_id)
+
+async def run_weather_backfill(venues: Optional[list[str]] = None, start_date: Optional[str] = None,
+                               end_date: Optional[str] = None, max_window_days: int = MAX_WINDOW_DAYS) -> dict:
+    job_id = await create_backfill_job(venues, start_date, end_date, max_window_days)
+    return await run_backfill_job(job_id)
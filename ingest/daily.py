@@ -8,14 +8,15 @@ Original file is located at
 """
 
 import asyncio
-from clients.visual_crossing import CITY_ALIAS, fetch_weather_for_city, upsert_daily_weather_csv_async
+from clients.visual_crossing import CITY_ALIAS, fetch_weather_for_city
+from store.weather import upsert_daily_weather_async
 from typing import Optional
 from datetime import date
 
 DEFAULT_VENUES = ["PAMPLONA", "BILBAO", "BURGOS", "VITORIA", "ZARAGOZA", "SAN SEBASTIAN"]
 
 async def run_daily_weather_ingest(venues: list[str] | None = None, start_date: Optional[str] = None, end_date: Optional[str] = None):
-    """Consulta Visual Crossing para cada venue y guarda en CSV."""
+    """Consulta Visual Crossing para cada venue y guarda en el weather store."""
     venues = venues or DEFAULT_VENUES
     print("🚀 [ingest] Empezando ingest para venues:", venues)
     # Concult official names in Visual Crossing
@@ -29,16 +30,17 @@ async def run_daily_weather_ingest(venues: list[str] | None = None, start_date:
     tasks = [fetch_weather_for_city(c, start_date, end_date) for c in cities]
     results = await asyncio.gather(*tasks, return_exceptions=True)
 
-    ok, errors = 0, []
+    errors, rows = [], []
     for city, res in zip(cities, results):
         if isinstance(res, Exception):
             print(f"❌ [ingest] Error en fetch de {city}: {res}")
             errors.append(f"{city}: {res}")
         else:
             print(f"📥 [ingest] {len(res)} filas recibidas para {city}")
-            for row in res:
-                await upsert_daily_weather_csv_async(row)
-            ok += len(res)
+            rows.extend(res)
+
+    # todas las ciudades en un solo upsert transaccional
+    ok = await upsert_daily_weather_async(rows)
 
     print(f"🏁 [ingest] Finalizado: {ok} filas upserted, {len(errors)} errores")
     return {"result": "success", "weather_upserted": ok, "errors": errors}
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Prefetch periódico del clima en segundo plano.
+
+Una tarea del event loop (arrancada desde el lifespan) refresca cada
+WEATHER_PREFETCH_INTERVAL segundos la previsión de hoy y los
+WEATHER_PREFETCH_DAYS días siguientes para DEFAULT_VENUES, así que los
+/daily_report encuentran el clima ya en el weather store y no esperan a
+Visual Crossing. Con WEATHER_PREFETCH_INTERVAL=0 no se arranca.
+"""
+
+import os
+import asyncio
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from ingest.daily import DEFAULT_VENUES, run_daily_weather_ingest
+
+WEATHER_PREFETCH_INTERVAL = float(os.getenv("WEATHER_PREFETCH_INTERVAL", "3600"))
+WEATHER_PREFETCH_DAYS = int(os.getenv("WEATHER_PREFETCH_DAYS", "2"))
+
+_task: Optional[asyncio.Task] = None
+_interval = WEATHER_PREFETCH_INTERVAL
+_last_run: dict = {}
+
+async def prefetch_once(venues: Optional[list[str]] = None, days: int = WEATHER_PREFETCH_DAYS) -> dict:
+    today = date.today()
+    res = await run_daily_weather_ingest(venues=venues or DEFAULT_VENUES, start_date=today.isoformat(),
+                                         end_date=(today + timedelta(days=days)).isoformat())
+    _last_run.update(res, finished_at=datetime.now().isoformat(timespec="seconds"))
+    return res
+
+async def _prefetch_loop(interval: float):
+    while True:
+        try:
+            await prefetch_once()
+        except Exception as e:
+            print(f"⚠️ [prefetch] Error refrescando el clima: {e!r}")
+        await asyncio.sleep(interval)
+
+def start_prefetch(interval: float = WEATHER_PREFETCH_INTERVAL):
+    global _task, _interval
+    if interval <= 0 or (_task is not None and not _task.done()):
+        return
+    _interval = interval
+    _task = asyncio.create_task(_prefetch_loop(interval))
+    print(f"⏰ [prefetch] Clima de hoy +{WEATHER_PREFETCH_DAYS} días cada {interval:.0f}s")
+
+async def stop_prefetch():
+    global _task
+    task, _task = _task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+def prefetch_stats() -> dict:
+    return {
+        "running": _task is not None and not _task.done(),
+        "interval": _interval,
+        "days": WEATHER_PREFETCH_DAYS,
+        "last_run": dict(_last_run) or None,
+    }
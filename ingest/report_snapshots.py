@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Materialización programada de los daily reports.
+
+Una tarea del event loop (arrancada desde el lifespan) calcula cada día a
+las REPORT_MATERIALIZE_AT (hora local, fuera de horas) los reports de hoy
+y de los REPORT_MATERIALIZE_DAYS días siguientes para DEFAULT_VENUES, y los
+guarda en el store de snapshots; /daily_report los sirve de ahí por la
+mañana sin calcular nada. Si el proceso arranca después de la hora y la
+ejecución del día no se ha hecho, se lanza en ese momento. Con varios
+workers solo la hace el primero que la reclama. Con REPORT_MATERIALIZE_AT
+vacío no se arranca.
+"""
+
+import os
+import asyncio
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from ingest.daily import DEFAULT_VENUES
+from services.report import build_daily_reports, store_report_snapshots
+from store.report_snapshots import REPORT_SNAPSHOT_KEEP_DAYS, report_snapshots
+
+REPORT_MATERIALIZE_AT = os.getenv("REPORT_MATERIALIZE_AT", "02:00").strip()
+REPORT_MATERIALIZE_DAYS = int(os.getenv("REPORT_MATERIALIZE_DAYS", "1"))
+REPORT_MATERIALIZE_LANG = os.getenv("REPORT_MATERIALIZE_LANG", "es")
+REPORT_MATERIALIZE_TONE = os.getenv("REPORT_MATERIALIZE_TONE", "funny")
+
+_task: Optional[asyncio.Task] = None
+_last_run: dict = {}
+
+async def materialize_once(venues: Optional[list[str]] = None, dates: Optional[list[date]] = None,
+                           lang: str = REPORT_MATERIALIZE_LANG, tone: str = REPORT_MATERIALIZE_TONE) -> dict:
+    """Calcula y guarda los reports de `dates` (hoy..hoy+REPORT_MATERIALIZE_DAYS por defecto)."""
+    today = date.today()
+    dates = dates or [today + timedelta(days=i) for i in range(REPORT_MATERIALIZE_DAYS + 1)]
+    venues = venues or DEFAULT_VENUES
+    stored = {}
+    for target_date in dates:
+        reports = await build_daily_reports(venues, target_date, lang, tone)
+        stored[target_date.isoformat()] = await asyncio.to_thread(
+            store_report_snapshots, target_date, lang, tone, reports)
+    res = {"stored": stored}
+    _last_run.update(res, finished_at=datetime.now().isoformat(timespec="seconds"))
+    print(f"🗂️ [report_snapshots] Guardados {sum(stored.values())} reports ({', '.join(stored)})")
+    return res
+
+async def _scheduled_run(run_key: str):
+    if not await asyncio.to_thread(report_snapshots.claim_run, run_key):
+        return
+    res = await materialize_once()
+    # solo la ejecución programada borra los snapshots viejos (una manual puede ser de fechas pasadas)
+    keep_from = (date.today() - timedelta(days=REPORT_SNAPSHOT_KEEP_DAYS)).isoformat()
+    _last_run["pruned"] = await asyncio.to_thread(report_snapshots.prune, keep_from)
+    await asyncio.to_thread(report_snapshots.finish_run, run_key, sum(res["stored"].values()))
+
+async def _materialize_loop(at: time):
+    while True:
+        now = datetime.now()
+        run_at = datetime.combine(now.date(), at)
+        if now >= run_at:
+            try:
+                await _scheduled_run(now.date().isoformat())
+            except Exception as e:
+                print(f"⚠️ [report_snapshots] Error generando reports: {e!r}")
+            run_at += timedelta(days=1)
+        await asyncio.sleep(max((run_at - datetime.now()).total_seconds(), 1))
+
+def start_materialize(at: str = REPORT_MATERIALIZE_AT):
+    global _task
+    if not at or (_task is not None and not _task.done()):
+        return
+    run_at = time.fromisoformat(at)
+    _task = asyncio.create_task(_materialize_loop(run_at))
+    print(f"⏰ [report_snapshots] Reports de hoy +{REPORT_MATERIALIZE_DAYS} días cada día a las {run_at:%H:%M}")
+
+async def stop_materialize():
+    global _task
+    task, _task = _task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+def materialize_stats() -> dict:
+    return {
+        "running": _task is not None and not _task.done(),
+        "at": REPORT_MATERIALIZE_AT or None,
+        "days": REPORT_MATERIALIZE_DAYS,
+        "last_run": dict(_last_run) or None,
+        "store": report_snapshots.stats(),
+    }
@@ -1,36 +1,61 @@
 # -*- coding: utf-8 -*-
 
 from fastapi import FastAPI, Query, Body, Request
-from db import fn_get_connection
+from db import DB_BACKEND, open_db, close_db
 from fastapi.middleware.cors import CORSMiddleware
 import pandas as pd
-import requests
-import csv
-import os
 from typing import Optional
-from pathlib import Path
+from urllib.parse import urlsplit
 import asyncio
-from datetime import datetime, date, timedelta
-import calendar
+from datetime import datetime
+from contextlib import asynccontextmanager
 from ingest.daily import run_daily_weather_ingest
-from clients.visual_crossing import fetch_weather_for_city, upsert_daily_weather_csv_async
-
-app = FastAPI()
-
-#rutas csv sintéticos
-SALES_CSV = "data/synthetic_sales_details.csv"
-CASHFLOW_CSV = "data/synthetic_cash_flow.csv"
-EBITDA_CSV = "data/synthetic_ebitda.csv"
-RESERVAS_CSV = "data/synthetic_reservas.csv"
-STOCK_CSV = "data/synthetic_stock.csv"
-
-EVENTS_CSV = "data/daily_events.csv"
-MOTIVATION_CSV = "data/motivational_phrases.csv"
+from ingest.prefetch import start_prefetch, stop_prefetch, prefetch_stats
+from ingest.backfill import create_backfill_job, run_backfill_job, backfill_status
+from ingest.report_snapshots import materialize_once, materialize_stats, start_materialize, stop_materialize
+from store.datasets import day_ordinal, registry as datasets
+from store.shared import current_version
+from store.reports import append_reports
+from store.report_snapshots import report_snapshots
+from store.weather import weather_store
+from store.stock_alerts import LEVELS, STOCK_ALERT_LOW, STOCK_ALERT_MEDIUM
+from clients.visual_crossing import CITY_ALIAS, get_client, close_client, venue_for_city, weather_breaker
+from services.kpi_cache import kpi_cache
+from services.kpi import execute_kpi, execute_kpi_batch, execute_kpi_page, stream_kpi
+from services.paging import QUERY_MAX_PAGE_SIZE
+from services.encoding import frame_payload, json_response
+from fastapi.responses import Response, StreamingResponse
+from services.weather import weather_flight
+from services.report import (COMPANY, build_daily_report, build_daily_reports, has_real_kpis, report_row,
+                            store_report_snapshots)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await open_db()
+    except Exception as e:
+        print(f"[WARN] No se pudo abrir el pool de conexiones ({DB_BACKEND}): {e}")
+    try:
+        await asyncio.to_thread(datasets.warm)
+    except Exception as e:
+        print(f"[WARN] No se pudieron precargar los datasets: {e}")
+    get_client()  # cliente HTTP compartido de Visual Crossing
+    try:
+        await asyncio.to_thread(weather_store.import_csv)
+    except Exception as e:
+        print(f"[WARN] No se pudo preparar el weather store: {e}")
+    start_prefetch()
+    start_materialize()
+    yield
+    await stop_materialize()
+    await stop_prefetch()
+    await close_client()
+    await close_db()
 
-DATA_DIR = Path("/weather")
-WEATHER_CSV = str(DATA_DIR / "daily_weather.csv")
+app = FastAPI(lifespan=lifespan)
 
-REPORTS_CSV = str(DATA_DIR / "daily_reports.csv")
+# referencias a las tareas lanzadas en segundo plano (evita que el GC las recoja)
+_background_tasks: set = set()
 
 app.add_middleware(
     CORSMiddleware,
@@ -40,70 +65,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-kpi_function_map = {
-    "fn_weekly_avg_ticket_by_venue": {
-        "args": ["p_company_name", "p_week_number", "p_year"]
-    },
-    "fn_estimated_profit_by_company_and_period": {
-        "args": ["p_company_name", "p_year", "p_week_number", "p_month_number"]
-    },
-    "fn_estimated_profit_by_venue_and_period": {
-        "args": ["p_company_name", "p_venue_name", "p_year", "p_week_number", "p_month_number"]
-    },
-    "fn_estimated_profit_by_venues_and_week": {
-        "args": ["p_company_name", "p_year", "p_week_number"]
-    },
-    "fn_personnel_expense_ratio": {
-        "args": ["p_company_name", "p_year", "p_venue_name","p_week_number", "p_month_number"]
-    },
-    "fn_total_income_by_period": {
-        "args": ["p_company_name", "p_year", "p_week_number", "p_month_number"]
-    },
-    "fn_week_total_attendees": {
-        "args": ["p_company_name", "p_week_number", "p_year"]
-    },
-    "fn_weekly_attendance_by_venue": {
-        "args": ["p_company_name", "p_week_number", "p_year"]
-    },
-    "fn_weekly_avg_income_per_attendee": {
-        "args": ["p_company_name", "p_week_number", "p_year"]
-    },
-    "fn_weekly_sales_comparison_by_section": {
-        "args": ["p_company_name", "p_week_number", "p_year"]
-    },
-    "fn_weekly_venues_income": {
-        "args": ["p_company_name", "p_week_number", "p_year", "p_month_number"]
-    },
-    "get_debit_variation_by_company_and_period": {
-        "args": ["p_company_name", "p_week_number", "p_year", "p_month_number"]
-    },
-    "get_debit_variation_by_venue_and_period": {
-        "args": ["p_company_name", "p_venue_name", "p_year","p_week_number", "p_month_number"]
-    },
-    "get_venue_income_by_period": {
-        "args": ["p_company_name", "p_venue_name" , "p_year", "p_week_number", "p_month_number"]
-    },
-    "fn_personnel_expense_ratio2": {
-        "args": ["p_company_name", "p_venue_name", "p_year", "p_week_number", "p_month_number"]
-    },
-    "fn_weekly_total_income_no_digital": {
-        "args": ["p_company_name", "p_week_number", "p_year"]
-    },
-    "fn_weekly_venues_income_no_digital": {
-        "args": ["p_company_name", "p_week_number", "p_year"]
-    },
-    ".get_departmental_expenses": {
-        "args": ["p_company_name", "p_year", "p_month_number"]
-    }
-    }
+WEATHER_MAX_RANGE_DAYS = 366
 
 @app.get("/weather")
-def get_weather(city: str, date_str: str):
-    if not os.path.exists(WEATHER_CSV):
-        return {"result": "error", "message": "No weather data"}
-    df = pd.read_csv(WEATHER_CSV)
-    filtered = df[df["city"].str.contains(city, case=False, na=False) & (df["date"].astype(str) == str(date_str).strip())]
-    return {"result": "success", "data": filtered.to_dict(orient="records")}
+async def get_weather(city: Optional[str] = None, date_str: Optional[str] = None,
+                      start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """Un día (city + date_str) o modo rango: varias ciudades separadas por comas
+    (o todos los venues si se omite city) entre start_date y end_date."""
+    try:
+        start = datetime.strptime(str(start_date or date_str).strip(), "%Y-%m-%d").date()
+        end = datetime.strptime(str(end_date).strip(), "%Y-%m-%d").date() if end_date else start
+    except ValueError:
+        return {"result": "error", "message": "date_str/start_date/end_date deben tener formato YYYY-MM-DD"}
+    if end < start or (end - start).days >= WEATHER_MAX_RANGE_DAYS:
+        return {"result": "error", "message": f"Rango de fechas inválido (máximo {WEATHER_MAX_RANGE_DAYS} días)"}
+
+    cities = [c.strip() for c in city.split(",") if c.strip()] if city else list(CITY_ALIAS)
+    venues = [venue_for_city(c) for c in cities]
+    known = [v for v in venues if v is not None]
+    rows = await asyncio.to_thread(weather_store.lookup_range, known, start.isoformat(), end.isoformat())
+    for name, venue in zip(cities, venues):
+        if venue is None:
+            # ciudad sin venue: búsqueda por nombre en el store
+            rows += await asyncio.to_thread(weather_store.search, name, start.isoformat(), end.isoformat())
+    return json_response({"result": "success", "data": rows})
 
 @app.post("/ingest/daily-weather")
 async def ingest_daily_weather(payload: dict = Body(default={})):
@@ -114,218 +99,57 @@ async def ingest_daily_weather(payload: dict = Body(default={})):
     res = await run_daily_weather_ingest(venues=venues, start_date=start_date, end_date=end_date)
     return res
 
-async def handle_weather_forecast(params: dict):
-
-    city = str(params.get("p_venue_name") or params.get("p_city") or "").strip()
-
-    if not city:
-        return {
-            "error": "Faltan parámetros requeridos: p_venue_name/p_city"
-        }
-
-    start_date_str = params.get("p_start_date")
-    end_date_str = params.get("p_end_date")
-
-    if not start_date_str:
-        today_iso      = date.today().isoformat()
-        start_date_str = today_iso
-        end_date_str   = today_iso
-    elif not end_date_str:
-        # Si solo falta end_date, lo igualamos a start_date
-        end_date_str   = start_date_str
-
-    start_dt = pd.to_datetime(start_date_str).date()
-    end_dt   = pd.to_datetime(end_date_str).date()
-
-    start_iso = start_dt.isoformat()
-    end_iso   = end_dt.isoformat()
-
-    rows = await fetch_weather_for_city(city, start_iso, end_iso)
-
-    for row in rows:
-        await upsert_daily_weather_csv_async(row)
-        
-    return {"result": "success", "data": rows}
-
-def fallback_to_csv(fn_name, params):
-    #lee los csv sintéticos
-    if fn_name == "cash_flow_synthetic_by_week":
-        df = pd.read_csv(CASHFLOW_CSV)
-        filtered = df[
-            (df["p_year"] == params.get("p_year")) &
-            (df["p_week_number"] == params.get("p_week_number"))
-        ]
-        cols_income = [c for c in df.columns if c.endswith("_income_predicted")]
-        result_df = filtered[["p_venue_name", "p_year", "p_week_number"] + cols_income]
-        
-        return {"result": "success", "data": result_df.to_dict(orient="records")}
-
-    elif fn_name == "cash_flow_synthetic_by_venue":
-        df = pd.read_csv(CASHFLOW_CSV)
-        filtered = df[
-            (df["p_venue_name"] == params.get("p_venue_name")) &
-            (df["p_year"] == params.get("p_year")) &
-            (df["p_week_number"] == params.get("p_week_number"))
-        ]
-        cols_income = [c for c in df.columns if c.endswith("_income_predicted")]
-        result_df = filtered[["p_venue_name", "p_year", "p_week_number"] + cols_income]
-        return {"result": "success", "data": result_df.to_dict(orient="records")}
-
-    elif fn_name == "cogs_synthetic_by_venue":
-        df = pd.read_csv(SALES_CSV)
-        filtered = df[
-            (df["p_company_name"] == params.get("p_company_name")) &
-            (df["p_year"] == params.get("p_year")) &
-            (df["p_venue_name"] == params.get("p_venue_name"))
-        ]
-        return {"result": "success", "data": filtered.to_dict(orient="records")}
-
-    elif fn_name == "cogs_synthetic_by_week":
-        df = pd.read_csv(SALES_CSV)
-        filtered = df[
-            (df["p_company_name"] == params.get("p_company_name")) &
-            (df["p_year"] == params.get("p_year")) &
-            (df["p_week_number"] == params.get("p_week_number"))
-        ]
-        return {"result": "success", "data": filtered.to_dict(orient="records")}
-
-
-    elif fn_name == "ebitda_synthetic_by_month":
-        df = pd.read_csv(EBITDA_CSV)
-        filtered = df[
-            (df["p_company_name"] == params.get("p_company_name")) &
-            (df["p_year"] == params.get("p_year")) &
-            (df["p_month_number"] == params.get("p_month_number"))
-        ]
-        return {"result": "success", "data": filtered.to_dict(orient="records")}
-
-    elif fn_name == "ebitda_synthetic_by_venue":
-        df = pd.read_csv(EBITDA_CSV)
-        filtered = df[
-            (df["p_company_name"] == params.get("p_company_name")) &
-            (df["p_year"] == params.get("p_year")) &
-            (df["p_venue_name"] == params.get("p_venue_name"))
-        ]
-        return {"result": "success", "data": filtered.to_dict(orient="records")}
-
-    elif fn_name == "reservas_synthetic_by_week":
-        df = pd.read_csv(RESERVAS_CSV)
-        # Filtro base por compañía (no filtramos por año todavía porque podría cruzar)
-        filtered_base = df[(df["p_company_name"] == params.get("p_company_name"))]
-        year = params.get("p_year")
-        week_start = params.get("p_week_number")
-        week_end = params.get("p_week_number_end")
-    
-        if week_start is not None and week_end is None:
-            # Solo una semana, mismo año
-            filtered = filtered_base[
-                (filtered_base["p_year"] == year) &
-                (filtered_base["p_week_number"] == week_start)
-            ]
-        elif week_start is not None and week_end is not None:
-            if week_end >= week_start:
-                # Rango dentro del mismo año
-                filtered = filtered_base[
-                    (filtered_base["p_year"] == year) &
-                    (filtered_base["p_week_number"] >= week_start) &
-                    (filtered_base["p_week_number"] <= week_end)
-                ]
-            else:
-                # Rango cruza de año: [week_start..última del año] ∪ [1..week_end del año siguiente]
-                filtered_current_year = filtered_base[
-                    (filtered_base["p_year"] == year) &
-                    (filtered_base["p_week_number"] >= week_start)
-                ]
-                filtered_next_year = filtered_base[
-                    (filtered_base["p_year"] == year + 1) &
-                    (filtered_base["p_week_number"] <= week_end)
-                ]
-                filtered = pd.concat([filtered_current_year, filtered_next_year], ignore_index=True)
-        else:
-            # Sin semanas provistas → devuelve solo el año solicitado (o vacío si prefieres)
-            filtered = filtered_base[(filtered_base["p_year"] == year)]
-    
-        return {"result": "success", "data": filtered.to_dict(orient="records")}
-        
-    elif fn_name == "reservas_synthetic_by_venue":
-        df = pd.read_csv(RESERVAS_CSV)
-        # Filtro base por compañía y venue (no filtramos por año todavía porque podría cruzar)
-        filtered_base = df[
-            (df["p_company_name"] == params.get("p_company_name")) &
-            (df["p_venue_name"] == params.get("p_venue_name"))
-        ]
-    
-        year = params.get("p_year")
-        week_start = params.get("p_week_number")
-        week_end = params.get("p_week_number_end")
-    
-        if week_start is not None and week_end is None:
-            # Solo una semana, mismo año
-            filtered = filtered_base[
-                (filtered_base["p_year"] == year) &
-                (filtered_base["p_week_number"] == week_start)
-            ]
-    
-        elif week_start is not None and week_end is not None:
-            if week_end >= week_start:
-                # Rango dentro del mismo año
-                filtered = filtered_base[
-                    (filtered_base["p_year"] == year) &
-                    (filtered_base["p_week_number"] >= week_start) &
-                    (filtered_base["p_week_number"] <= week_end)
-                ]
-            else:
-                # Rango cruza de año: [week_start..última del año] ∪ [1..week_end del año siguiente]
-                filtered_current_year = filtered_base[
-                    (filtered_base["p_year"] == year) &
-                    (filtered_base["p_week_number"] >= week_start)
-                ]
-                filtered_next_year = filtered_base[
-                    (filtered_base["p_year"] == year + 1) &
-                    (filtered_base["p_week_number"] <= week_end)
-                ]
-                filtered = pd.concat([filtered_current_year, filtered_next_year], ignore_index=True)
-        else:
-            # Sin semanas provistas → devuelve solo el año solicitado (o vacío si prefieres)
-            filtered = filtered_base[(filtered_base["p_year"] == year)]
-    
-        return {"result": "success", "data": filtered.to_dict(orient="records")}
-
-
-    elif fn_name == "stock_synthetic_by_week":
-        df = pd.read_csv(STOCK_CSV)
-        filtered = df[
-            (df["p_company_name"] == params.get("p_company_name")) &
-            (df["p_year"] == params.get("p_year"))
-        ]
-        if params.get("p_week_number") is not None:
-            filtered = filtered[filtered["p_week_number"] == params.get("p_week_number")]
-        elif params.get("p_week_start") is not None and params.get("p_week_end") is not None:
-            filtered = filtered[
-                (filtered["p_week_number"] >= params.get("p_week_start")) &
-                (filtered["p_week_number"] <= params.get("p_week_end"))
-            ]
-        return {"result": "success", "data": filtered.to_dict(orient="records")}
-
-    elif fn_name == "stock_synthetic_by_venue":
-        df = pd.read_csv(STOCK_CSV)
-        filtered = df[
-            (df["p_company_name"] == params.get("p_company_name")) &
-            (df["p_venue_name"] == params.get("p_venue_name")) &
-            (df["p_year"] == params.get("p_year"))
-        ]
-        if params.get("p_week_number") is not None:
-            filtered = filtered[filtered["p_week_number"] == params.get("p_week_number")]
-        elif params.get("p_week_start") is not None and params.get("p_week_end") is not None:
-            filtered = filtered[
-                (filtered["p_week_number"] >= params.get("p_week_start")) &
-                (filtered["p_week_number"] <= params.get("p_week_end"))
-            ]
-        return {"result": "success", "data": filtered.to_dict(orient="records")}
-        
-    # Si no encontramos el KPI ni en CSV
-    return {"result": "error", "message": f"No data found for {fn_name}"}
-    
+def _invalid_venues(venues) -> bool:
+    # un string suelto se recorrería letra a letra como si fueran venues
+    return venues is not None and (not isinstance(venues, list) or not all(isinstance(v, str) for v in venues))
+
+def _backfill_params_error(kwargs: dict) -> Optional[str]:
+    if _invalid_venues(kwargs.get("venues")):
+        return "venues debe ser una lista de nombres de venue"
+    try:
+        start = datetime.strptime(str(kwargs["start_date"]), "%Y-%m-%d").date() \
+            if "start_date" in kwargs else datetime.now().date()
+        end = datetime.strptime(str(kwargs["end_date"]), "%Y-%m-%d").date() if "end_date" in kwargs else start
+    except ValueError:
+        return "start_date y end_date deben tener formato YYYY-MM-DD"
+    if end < start:
+        return "end_date no puede ser anterior a start_date"
+    window = kwargs.get("max_window_days")
+    if window is not None and (isinstance(window, bool) or not isinstance(window, int) or window < 1):
+        return "max_window_days debe ser un entero positivo"
+    return None
+
+@app.post("/ingest/weather-backfill")
+async def ingest_weather_backfill(payload: dict = Body(default={})):
+    """Rellena/refresca el clima de un rango solo donde falta o está caducado.
+
+    Body: {"venues": [...], "start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD",
+           "max_window_days": 30, "job_id": null, "background": false}
+    Con job_id se reanuda ese job (solo las ventanas que no terminaron).
+    """
+    job_id = payload.get("job_id")
+    if job_id is None:
+        kwargs = {k: payload[k] for k in ("venues", "start_date", "end_date", "max_window_days") if payload.get(k)}
+        error = _backfill_params_error(kwargs)
+        if error:
+            return {"result": "error", "message": error}
+        job_id = await create_backfill_job(**kwargs)
+    elif await asyncio.to_thread(backfill_status, job_id) is None:
+        return {"result": "error", "message": f"Job {job_id} no encontrado"}
+
+    if payload.get("background"):
+        task = asyncio.create_task(run_backfill_job(job_id))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        return {"result": "success", "job_id": job_id, "status": "running"}
+    return {"result": "success", "data": await run_backfill_job(job_id)}
+
+@app.get("/ingest/weather-backfill/{job_id}")
+async def get_weather_backfill(job_id: str):
+    status = await asyncio.to_thread(backfill_status, job_id)
+    if status is None:
+        return {"result": "error", "message": f"Job {job_id} no encontrado"}
+    return {"result": "success", "data": status}
 
 @app.get("/")
 def read_root():
@@ -342,54 +166,49 @@ async def run_query(request: Request):
   data = await request.json()
   print("data: ", data)
   fn_name = data.get("function")
-  params: Dict = data.get("params", {})
+  params: dict = data.get("params", {})
 
-  if fn_name == "weather_forecast":
-      return await handle_weather_forecast(params)
+  # "stream": true (o Accept: application/x-ndjson) -> una fila JSON por línea
+  if data.get("stream") or "application/x-ndjson" in request.headers.get("accept", ""):
+      rows = await stream_kpi(fn_name, params)
+      if isinstance(rows, dict):
+          return rows
+      return StreamingResponse(rows, media_type="application/x-ndjson")
 
-  try:
-    print("🔵 Parámetros recibidos:", params)
-    print("🔵 Función solicitada:", fn_name)
-      
-    conn = fn_get_connection()
-    print("Conectado a la base de datos")
-    cur = conn.cursor()
-    cur.execute("SET search_path TO dwh, public;")
-    
-    fn_info = kpi_function_map.get(fn_name)
-    if not fn_info:
-        print(f"[WARM] Función {fn_name} no está en el mapa, activando fallback")
-        return fallback_to_csv(fn_name, params)
-        
-    arg_names = fn_info["args"]
-    args = [params.get(arg) for arg in arg_names]
-    
-    placeholders = ", ".join(["%s"] * len(args))
-    query = f"SELECT * FROM dwh.{fn_name}({placeholders});"
-    
-    
-    print("🟢 Ejecutando:", query)
-    print("📦 Con args:", args)
-    
-    cur.execute(query, args)
-    
-    result = cur.fetchall()
-    
-    cur.close()
-    conn.close()
-    
-    print("bien, consulta bien")
+  # "shape": "columns" -> data como {"columns": [...], "rows": [[...]]}
+  shape = data.get("shape", "records")
 
-    if result:
-        return {"result": "success", "data": result}
+  # "limit" / "cursor" -> paginado; la respuesta trae "next_cursor" mientras queden filas
+  if data.get("limit") is not None or data.get("cursor"):
+      return json_response(await execute_kpi_page(fn_name, params, data.get("limit") or QUERY_MAX_PAGE_SIZE,
+                                                  data.get("cursor"), shape))
 
-    print(f"[WARN] No hay datos en DWH para {fn_name}, activando fallback CSV")
-      
-    return fallback_to_csv(fn_name, params)
-    
-  except Exception as e:
-    print("error al ejecutar", e)
-    return {"status": "error", "message": str(e)}
+  return json_response(await execute_kpi(fn_name, params, shape))
+
+@app.post("/query/batch")
+async def run_query_batch(request: Request):
+  """Varias funciones en una llamada.
+
+  Body: {"queries": [{"function": "fn_...", "params": {...}}, ...]} (o directamente la lista).
+  Cada resultado lleva su propio status; un fallo no tumba el resto.
+  """
+  data = await request.json()
+  items = data.get("queries") if isinstance(data, dict) else data
+  shape = data.get("shape", "records") if isinstance(data, dict) else "records"
+  return json_response(await execute_kpi_batch(items, shape))
+
+LOOKUP_MAX_RANGE_DAYS = 366
+
+def _lookup_range(start_date: str, end_date: Optional[str]):
+    """(inicio, fin) de los endpoints de rango, o un dict de error."""
+    try:
+        start = datetime.strptime(start_date.strip(), "%Y-%m-%d").date()
+        end = datetime.strptime(end_date.strip(), "%Y-%m-%d").date() if end_date else start
+    except ValueError:
+        return {"result": "error", "message": "start_date/end_date deben tener formato YYYY-MM-DD"}
+    if end < start or (end - start).days >= LOOKUP_MAX_RANGE_DAYS:
+        return {"result": "error", "message": f"Rango de fechas inválido (máximo {LOOKUP_MAX_RANGE_DAYS} días)"}
+    return start, end
 
 @app.get("/events")
 def get_events(
@@ -398,27 +217,64 @@ def get_events(
 ):
     # Validación de fecha
     try:
-        _ = datetime.strptime(date_str, "%Y-%m-%d").date()
+        target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
     except ValueError:
         return {"result": "error", "message": "date_str debe tener formato YYYY-MM-DD"}
 
-    if not  os.path.exists(EVENTS_CSV):
+    # Índice (fecha, ciudad normalizada) construido al cargar el CSV
+    try:
+        events = datasets.index("events", "lookup")
+    except FileNotFoundError:
         return {"result": "error", "message": "No events data"}
 
-    # Leemos como texto para evitar NaNs (nacionales guardadas como vacío)
-    df = pd.read_csv(EVENTS_CSV, dtype=str).fillna("")
-    df = df[df["date"] == date_str]
-
-    if city:
-        city_norm = city.strip().upper()
-        # city en CSV puede venir en mayúsculas o vacío para nacionales
-        df = df[df["city"].str.upper() == city_norm]
-    else:
-        # Nacionales: city vacía
-        df = df[df["city"] == ""]
+    return json_response({"result": "success", "data": frame_payload(events.on(target_date.isoformat(), city))})
+
+@app.get("/events/range")
+def get_events_range(start_date: str, end_date: Optional[str] = None, cities: Optional[str] = None,
+                     national: bool = True):
+    """Eventos entre start_date y end_date de varias ciudades (separadas por comas, todas si se
+    omite cities), más los nacionales salvo national=false."""
+    window = _lookup_range(start_date, end_date)
+    if isinstance(window, dict):
+        return window
+    start, end = window
+    try:
+        events = datasets.index("events", "lookup")
+    except FileNotFoundError:
+        return {"result": "error", "message": "No events data"}
+    city_list = [c for c in cities.split(",") if c.strip()] if cities else None
+    rows = events.between(start.isoformat(), end.isoformat(), city_list, national)
+    return json_response({"result": "success", "data": frame_payload(rows)})
+
+STOCK_ALERTS_MAX_RANGE_DAYS = 366
+
+@app.get("/stock_alerts")
+def get_stock_alerts(start_date: str, end_date: Optional[str] = None, venues: Optional[str] = None,
+                     company: str = COMPANY, low: float = STOCK_ALERT_LOW, medium: float = STOCK_ALERT_MEDIUM,
+                     level: Optional[str] = None):
+    """Productos con ratio stock/capacity < low ("bajo") o < medium ("medio") de varios venues
+    (separados por comas, o todos si se omite venues) entre start_date y end_date."""
+    try:
+        start = datetime.strptime(start_date.strip(), "%Y-%m-%d").date()
+        end = datetime.strptime(end_date.strip(), "%Y-%m-%d").date() if end_date else start
+    except ValueError:
+        return {"result": "error", "message": "start_date/end_date deben tener formato YYYY-MM-DD"}
+    if end < start or (end - start).days >= STOCK_ALERTS_MAX_RANGE_DAYS:
+        return {"result": "error", "message": f"Rango de fechas inválido (máximo {STOCK_ALERTS_MAX_RANGE_DAYS} días)"}
+    if not 0 <= low <= medium:
+        return {"result": "error", "message": "Los umbrales deben cumplir 0 <= low <= medium"}
+    if level is not None and level not in LEVELS:
+        return {"result": "error", "message": f"level debe ser uno de {', '.join(LEVELS)}"}
 
-    data = df.to_dict(orient="records")
-    return {"result": "success", "data": data}
+    try:
+        alerts = datasets.index("stock", "alerts")
+    except FileNotFoundError:
+        return {"result": "error", "message": "No stock data"}
+    venue_list = [v.strip().upper() for v in venues.split(",") if v.strip()] if venues else None
+    rows = alerts.rows(company, venue_list, day_ordinal(start), day_ordinal(end), low, medium)
+    if level is not None:
+        rows = rows[rows["level"] == level]
+    return json_response({"result": "success", "data": frame_payload(rows)})
 
 @app.get("/motivation")
 def get_motivation(
@@ -432,270 +288,131 @@ def get_motivation(
     except ValueError:
         return {"result": "error", "message": "date_str debe tener formato YYYY-MM-DD"}
 
-    if not os.path.exists(MOTIVATION_CSV):
+    try:
+        phrases = datasets.index("motivation", "lookup")
+    except FileNotFoundError:
         return {"result": "error", "message": "No motivation data"}
 
-    df = pd.read_csv(MOTIVATION_CSV, dtype=str).fillna("")
-
-    # Filtro por idioma/tono
-    subset = df[(df["lang"].str.lower() == lang.lower()) & (df["tone"].str.lower() == tone.lower())]
-
-    if subset.empty:
-        # Fallback: ignora filtros si no hay coincidencias
-        subset = df.copy()
-
-    if subset.empty:
+    # "Frase del día" determinista (igual en todos los workers); sin frases de lang/tone usa todas
+    row = phrases.pick(target_date.isoformat(), lang, tone)
+    if row is None:
         return {"result": "error", "message": "No hay frases disponibles"}
 
-    # Selección determinista de "frase del día"
-    idx = hash((date_str, lang.lower(), tone.lower())) % len(subset)
-    row = subset.iloc[idx].to_dict()
-
     return {"result": "success", "data": [row]}
 
-def get_weekday_label(dt:date):
-  return calendar.day_abbr[dt.weekday()].lower()
-
-def get_weekday_number(dt:date):
-  return dt.weekday()
-
-async def ingest_one_day(city: str, date_str: str):
-    rows = await fetch_weather_for_city(city, date_str)
-    if not rows:
-        raise RuntimeError(f"No se obtuvieron datos para {city} {date_str}")
-    for row in rows:
-        await upsert_daily_weather_csv_async(row)
-
+@app.get("/motivation/range")
+def get_motivation_range(start_date: str, end_date: Optional[str] = None, lang: str = "es", tone: str = "funny"):
+    """Frase del día de cada fecha entre start_date y end_date."""
+    window = _lookup_range(start_date, end_date)
+    if isinstance(window, dict):
+        return window
+    try:
+        phrases = datasets.index("motivation", "lookup")
+    except FileNotFoundError:
+        return {"result": "error", "message": "No motivation data"}
+    return json_response({"result": "success", "data": phrases.between(*window, lang, tone)})
 
 @app.get("/daily_report")
-async def get_daily_report(url: str, venue_name :str, date : datetime,lang:str="es", tone:str ="funny"):
-
-  company = "PALLAPIZZA"
+async def get_daily_report(request: Request, venue_name :str, date : datetime, url: Optional[str] = None,
+                           lang:str="es", tone:str ="funny", refresh: bool = False):
+  # url solo para un backend KPI remoto; si apunta a este mismo servidor se resuelve en proceso
+  if url and urlsplit(url).netloc == request.url.netloc:
+      url = None
   target_date = pd.to_datetime(date).date()
-  year = target_date.year
-  week_number = target_date.isocalendar().week
-  weekday_label = get_weekday_label(target_date)  # 'mon', 'tue', etc.
-  weekday_label_full = target_date.strftime("%A").lower()
-  weekday_number = get_weekday_number(target_date)
-  date_str = target_date.isoformat()
-
-  #kpi_data
-  # we need last_year_{weekday} as objective
-  response = requests.post(f"{url}/query",
-        json={
-            "function": "fn_weekly_venues_income",
-            "params": {
-                "p_company_name": company,
-                "p_year": year,
-                "p_week_number": week_number
-            }
-        })
-
-  if response.status_code != 200:
-        return {"error": "API call failed", "details": response.text}
 
+  # snapshot precalculado (ingest.report_snapshots) salvo refresh o backend remoto
+  if not url and not refresh:
+      snapshot = await asyncio.to_thread(report_snapshots.get, venue_name, target_date.isoformat(), lang, tone)
+      if snapshot is not None:
+          body, built_at = snapshot
+          return Response(body, media_type="application/json", headers={"X-Report-Snapshot": built_at})
+
+  report = await build_daily_report(venue_name, target_date, lang, tone, url)
+  if not url:
+      await asyncio.to_thread(store_report_snapshots, target_date, lang, tone, {venue_name: report})
+  return json_response(report)
+
+
+@app.post("/daily_report/batch")
+async def get_daily_report_batch(request: Request, payload: dict = Body(default={})):
+  """Reports de varios venues (por defecto todos) para una fecha en una sola llamada.
+
+  Body: {"date": "YYYY-MM-DD", "venues": [...], "lang": "es", "tone": "funny",
+         "persist": false, "url": null}
+  """
+  venues = payload.get("venues")
+  if _invalid_venues(venues):
+      return {"result": "error", "message": "venues debe ser una lista de nombres de venue"}
   try:
-    kpi_data = response.json()["data"]
-  except json.JSONDecodeError as e:
-    return {"error": "Invalid JSON response", "details": str(e)}
-
-  #search by venue
-  venue_data = next((item for item in kpi_data if item["venue_name"].upper() == venue_name.upper()), None)
-  if venue_data is None:
-    return {"error": "Venue not found"}
-
-  #previous year as objective
-  target_income = venue_data.get(f"last_year_{weekday_label_full}", 0)
-
-  response_att = requests.post(f"{url}/query", json={
-        "function": "fn_weekly_attendance_by_venue",
-        "params": {
-            "p_company_name": company,
-            "p_year": year,
-            "p_week_number": week_number
-        }
-    })
-  
-  attendance_data = response_att.json().get("data", [])
-  attendance_row = next((row for row in attendance_data if row["venue_name"].upper() == venue_name.upper()), None) 
-
-  if attendance_row:
-        attendance_last = attendance_row.get(f"{weekday_label}_prev", 0)
-        current_attendance = int(attendance_last * 1.1)
-        if attendance_last > 0:
-            attendance_variation = ((current_attendance - attendance_last) / attendance_last) * 100
-        else:
-            attendance_variation = 0.0
-  else:
-      attendance_last = 0
-      current_attendance = 0
-      attendance_variation = 0
-
-  reservas_df = pd.read_csv(RESERVAS_CSV)
-  reservas_filtered = reservas_df[
-      (reservas_df["p_company_name"] == company) &
-      (reservas_df["p_venue_name"] == venue_name) &
-      (reservas_df["p_year"] == year) &
-      (reservas_df["p_week_number"] == week_number) &
-      (reservas_df["weekday"] == weekday_number)
-  ]
-  if not reservas_filtered.empty:
-      num_reservas = int(reservas_filtered.iloc[0]["reservations"])
-  else: num_reservas = 0
-
-  # 2. STOCK
-  stock_df = pd.read_csv(STOCK_CSV)
-  stock_filtered = stock_df[
-      (stock_df["p_company_name"] == company) &
-      (stock_df["p_venue_name"] == venue_name) &
-      (stock_df["p_year"] == year) &
-      (stock_df["p_week_number"] == week_number)
-  ].copy()
-
-  stock_filtered["ratio"] = stock_filtered["stock"] / stock_filtered["capacity"]
-  productos_bajo_stock = stock_filtered[stock_filtered["ratio"] < 0.3]["product_name"].tolist()
-  productos_medio_stock = stock_filtered[
-      (stock_filtered["ratio"] >= 0.3) & (stock_filtered["ratio"] < 0.6)
-  ]["product_name"].tolist()
-
-  #motivation
-  if not os.path.exists(MOTIVATION_CSV):
-      phrase= "¡Ánimo! Hoy es un gran día para intentarlo."
-
-  else:
-    df = pd.read_csv(MOTIVATION_CSV, dtype=str).fillna("")
-
-    filtered = df[
-        (df["lang"].str.lower() == lang.lower()) &
-        (df["tone"].str.lower() == tone.lower())
-    ]
-
-    if filtered.empty:
-        filtered = df.copy()
-    phrase= filtered.iloc[hash((str(target_date), lang.lower(), tone.lower())) % len(filtered)]["text"]
-
-  #events
-  if not os.path.exists(EVENTS_CSV):
-        events, hay_futbol= [], False
-
-  else:
-    df = pd.read_csv(EVENTS_CSV, dtype=str).fillna("")
-    df_today = df[(df["date"] == target_date.isoformat()) & (df["city"].str.upper() == venue_name.upper())]
-    events = df_today["title"].tolist()
-    hay_futbol = any(df_today["has_football"].astype(str) == "1")
-
-  #weather
-  def generar_frase_clima(clima):
-    if clima:
-        if "rain" in clima or "lluvia" in clima:
-            return "Parece que lloverá ☔, tenlo en cuenta para las reservas."
-        elif "sun" in clima or "despejado" in clima:
-            return "¡Día soleado! La terraza seguro que se llena. ☀️"
-        elif "cloud" in clima or "nublado" in clima:
-            return "Día nublado, perfecto para comer algo caliente."
-        else:
-            return f"El clima de hoy es {clima}."
-    return "No tengo información del clima para hoy."
-      
-  weather_url = f"{url}/weather"
-  df_weather = pd.read_csv(WEATHER_CSV)
-  df_weather["date"] = pd.to_datetime(df_weather["date"]).dt.date
-
-  target_date = pd.to_datetime(date).date()
+      target_date = datetime.strptime(str(payload["date"]).strip(), "%Y-%m-%d").date() \
+          if payload.get("date") else datetime.now().date()
+  except ValueError:
+      return {"result": "error", "message": "date debe tener formato YYYY-MM-DD"}
   date_str = target_date.isoformat()
-
-  mask = (df_weather["city"].str.contains(venue_name, case=False, na=False) &
-    (df_weather["date"] == target_date))
-
-  weather_row = df_weather[mask]
-
-  if not weather_row.empty:
-    row = weather_row.iloc[0]
-    temperatura = weather_row.iloc[0]["temp"]
-    clima = str(weather_row.iloc[0]["conditions"]).lower()
-    icono = weather_row.iloc[0]["icon"]
-    frase_clima = generar_frase_clima(clima)
-
-  else:
+  url = payload.get("url")
+  if url and urlsplit(url).netloc == request.url.netloc:
+      url = None
+
+  reports = await build_daily_reports(venues, target_date,
+                                      payload.get("lang", "es"), payload.get("tone", "funny"), url)
+
+  persisted, persisted_venues = 0, []
+  if payload.get("persist"):
+      # con una etapa KPI degradada objetivo/asistencia/reservas/caja son relleno y no datos reales;
+      # sin clima o eventos el report se guarda igual (con su texto de aviso)
+      persisted_venues = [venue for venue, report in reports.items() if has_real_kpis(report)]
+      rows = [report_row(venue, date_str, reports[venue]) for venue in persisted_venues]
+      persisted = await asyncio.to_thread(append_reports, rows)
+
+  return {"result": "success", "date": date_str, "reports": reports, "persisted": persisted,
+          "persisted_venues": persisted_venues}
+
+
+@app.get("/admin/datasets")
+def get_datasets_stats():
+    return {"result": "success", "data": datasets.stats(), "shared_version": current_version()}
+
+@app.get("/admin/kpi_cache")
+def get_kpi_cache_stats():
+    return {"result": "success", "data": kpi_cache.stats()}
+
+@app.get("/admin/weather")
+def get_weather_stats():
+    return {"result": "success", "data": {"breaker": weather_breaker.stats(), "prefetch": prefetch_stats(),
+                                                "single_flight": weather_flight.stats()}}
+
+@app.get("/admin/report_snapshots")
+def get_report_snapshots_stats():
+    return {"result": "success", "data": materialize_stats()}
+
+@app.post("/admin/report_snapshots/materialize")
+async def materialize_report_snapshots(payload: dict = Body(default={})):
+    """Genera ya los snapshots. Body opcional: {"dates": ["YYYY-MM-DD", ...], "venues": [...], "lang", "tone"}"""
+    venues, lang, tone = payload.get("venues"), payload.get("lang", "es"), payload.get("tone", "funny")
+    if _invalid_venues(venues):
+        return {"result": "error", "message": "venues debe ser una lista de nombres de venue"}
+    if not isinstance(lang, str) or not isinstance(tone, str):
+        return {"result": "error", "message": "lang y tone deben ser texto"}
+    dates = payload.get("dates") or []
+    if not isinstance(dates, list):
+        return {"result": "error", "message": "dates debe ser una lista de fechas YYYY-MM-DD"}
     try:
-        await ingest_one_day(venue_name, date_str)
-        df = pd.read_csv(WEATHER_CSV)
-        df["date"] = pd.to_datetime(df["date"]).dt.date
-        weather_row = df[df["city"].str.contains(venue_name, case=False, na=False) &
-                (df["date"] == target_date)]
-
-        if not weather_row.empty:
-            row = weather_row.iloc[0]
-            temperatura = row["temp"]
-            clima = str(row["conditions"]).lower()
-            icono = row["icon"]
-            frase_clima = generar_frase_clima(clima)
-        else:
-            temperatura = clima = icono = None
-            frase_clima = "No tengo información del clima para hoy."
-
-    except Exception as e:
-        temperatura = clima = icono = None
-        frase_clima = f"No se pudo ingestar clima: {e}"
-
-  #cash_flow  
-  cashflow_df = pd.read_csv(CASHFLOW_CSV)
-  daily_income_col = f"{weekday_label_full}_income_predicted"
-
-  pred_row = cashflow_df[
-    (cashflow_df["p_venue_name"].str.upper() == venue_name.upper()) &
-    (cashflow_df["p_year"] == year) &
-    (cashflow_df["p_week_number"] == week_number)
-  ]
-
-  if not pred_row.empty and daily_income_col in cashflow_df.columns:
-    daily_income_predicted = float(pred_row.iloc[0][daily_income_col])
-  else:
-    daily_income_predicted = None
-
-
-  if daily_income_predicted is not None and target_income > 0:
-    daily_income_var = round(((daily_income_predicted - target_income) / target_income) * 100, 2)
-  else:
-    daily_income_var = None
-
-
-  if "frase_clima" not in locals():
-      frase_clima = "No tengo información detallada del clima."
-  return {
-      "result": "success",
-      "kpi_data": {
-          "objective": target_income,
-          "prediction": daily_income_predicted,
-          "prediction_var": daily_income_var,
-          "attendance_last": attendance_last,
-          "attendance_variation": attendance_variation,
-          "num_reservas": num_reservas
-      },
-      "synthetic_data": {
-          "productos_bajo_stock": productos_bajo_stock,
-          "productos_medio_stock": productos_medio_stock,
-          "fechas_importantes": events,
-          "clima": clima,
-          "temperatura": temperatura,
-          "frase_clima": frase_clima,
-          "frase_motivacional": phrase,
-          "hay_futbol": hay_futbol
-      }
-  }
+        dates = [datetime.strptime(str(d), "%Y-%m-%d").date() for d in dates]
+    except ValueError:
+        return {"result": "error", "message": "dates deben tener formato YYYY-MM-DD"}
+    res = await materialize_once(venues, dates or None, lang, tone)
+    return {"result": "success", **res}
 
+@app.post("/admin/kpi_cache/flush")
+async def flush_kpi_cache(payload: dict = Body(default={})):
+    # {"function": "fn_..."} para vaciar solo esa función
+    removed = kpi_cache.flush(payload.get("function"))
+    return {"result": "success", "flushed": removed}
 
 @app.post("/save_report_csv")
 async def save_report_csv(request: Request):
     data = await request.json()
 
-    # Si el archivo no existe, crea cabeceras
-    file_exists = os.path.exists(REPORTS_CSV)
-
-    with open(REPORTS_CSV, "a", newline="", encoding="utf-8") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=data.keys())
-        if not file_exists:
-            writer.writeheader()
-        writer.writerow(data)
+    await asyncio.to_thread(append_reports, [data])
 
     return {"status": "success", "message": "Reporte guardado"}
@@ -3,6 +3,7 @@ const DEFAULT_VENUES = ["PAMPLONA", "BILBAO", "BURGOS", "VITORIA", "ZARAGOZA", "
 
 async function run() {
   const backendUrl = process.env.BACKEND_URL;
+  const authToken = process.env.AUTH_TOKEN;
   const today = new Date().toISOString().split("T")[0]; // YYYY-MM-DD
 
   if (!backendUrl) {
@@ -12,40 +13,38 @@ async function run() {
 
   console.log(`📅 Generando reportes para el día ${today}...`);
 
-  for (const venue of DEFAULT_VENUES) {
-    try {
-      const response = await axios.get(`${backendUrl}/daily_report`, {
-        params: {
-          url: backendUrl,
-          venue_name: venue,
-          date: today,
-          lang: "es",
-          tone: "funny"
-        },
-        headers: authToken ? { Authorization: `Bearer ${authToken}` } : {}
-      });
-
-      if (response.status !== 200 || !response.data) {
-        console.warn(`⚠️ Error al obtener datos para ${venue}:`, response.statusText);
-        continue;
-      }
+  try {
+    // Un solo request: el backend calcula y guarda los reportes de todos los venues
+    const response = await axios.post(`${backendUrl}/daily_report/batch`, {
+      venues: DEFAULT_VENUES,
+      date: today,
+      lang: "es",
+      tone: "funny",
+      persist: true
+    }, {
+      headers: authToken ? { Authorization: `Bearer ${authToken}` } : {}
+    });
+
+    if (response.status !== 200 || !response.data) {
+      console.error("❌ Error al generar los reportes:", response.statusText);
+      process.exit(1);
+    }
 
-      const reportData = {
-        date: today,
-        venue,
-        ...response.data.kpi_data,
-        ...response.data.synthetic_data
-      };
-
-      // Guardar en backend como CSV
-      await axios.post(`${backendUrl}/save_report_csv`, reportData, {
-        headers:{}
-      });
-
-      console.log(`✅ Reporte guardado para ${venue}`);
-    } catch (err) {
-      console.error(`❌ Error procesando ${venue}:`, err.message);
+    const persisted = response.data.persisted_venues || [];
+    for (const venue of DEFAULT_VENUES) {
+      const report = response.data.reports[venue];
+      if (!report || report.error) {
+        console.warn(`⚠️ Error al obtener datos para ${venue}:`, report ? report.error : "sin reporte");
+      } else if (!persisted.includes(venue)) {
+        console.warn(`⚠️ Reporte de ${venue} no guardado (etapas degradadas: ${report.degraded.join(", ")})`);
+      } else {
+        console.log(`✅ Reporte guardado para ${venue}`);
+      }
     }
+    console.log(`💾 ${response.data.persisted} reportes guardados.`);
+  } catch (err) {
+    console.error("❌ Error procesando los reportes:", err.message);
+    process.exit(1);
   }
 
   console.log("🎉 Todos los reportes procesados.");
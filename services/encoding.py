@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Serialización JSON rápida de resultados.
+
+`dumps` codifica directamente a bytes con orjson (si está instalado; si no,
+con json de la stdlib) y `json_response` lo devuelve como respuesta sin
+pasar por el jsonable_encoder de FastAPI. En ambos casos:
+
+- NaN / inf / NaT / NA -> null
+- date / datetime / Timestamp -> ISO 8601
+- Decimal -> int si no tiene decimales, float si los tiene (como FastAPI)
+- escalares numpy -> número Python
+
+Con `shape="columns"` los resultados van como {"columns": [...], "rows": [[...]]}
+en vez de una lista de objetos, que repite los nombres en cada fila.
+"""
+
+import json
+import math
+from datetime import date, datetime, time
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # más lento pero mismo resultado
+    orjson = None
+
+SHAPES = ("records", "columns")
+
+def _default(value):
+    if value is pd.NaT or value is pd.NA:
+        return None
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        # numeric de PostgreSQL puede ser NaN / Infinity: igual que los float no finitos
+        if not value.is_finite():
+            return None
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    if isinstance(value, np.generic):
+        value = value.item()
+        if isinstance(value, float) and not math.isfinite(value):
+            return None
+        return value
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Tipo no serializable a JSON: {type(value).__name__}")
+
+def _finite(value):
+    """Para el camino sin orjson: json de la stdlib escribiría NaN, que no es JSON válido."""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {k: _finite(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(v) for v in value]
+    return value
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(content) -> bytes:
+        return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+else:
+    def _default_finite(value):
+        return _finite(_default(value))
+
+    def dumps(content) -> bytes:
+        return json.dumps(_finite(content), default=_default_finite, ensure_ascii=False,
+                          allow_nan=False, separators=(",", ":")).encode()
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+def json_response(content, status_code: int = 200) -> FastJSONResponse:
+    return FastJSONResponse(content, status_code=status_code)
+
+# --- formas del resultado ---
+
+def _frame_columns(frame: pd.DataFrame):
+    return [str(c) for c in frame.columns], [frame[c].tolist() for c in frame.columns]
+
+def frame_payload(frame: pd.DataFrame, shape: str = "records"):
+    """Filas del DataFrame como lista de objetos o como {"columns", "rows"}."""
+    columns, values = _frame_columns(frame)
+    if shape == "columns":
+        return {"columns": columns, "rows": list(zip(*values))}
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+def rows_payload(rows: list, shape: str = "records"):
+    """Lo mismo para filas ya en dicts (DWH, weather store)."""
+    if shape != "columns":
+        return rows
+    columns = list(rows[0].keys()) if rows else []
+    return {"columns": columns, "rows": [[row.get(c) for c in columns] for row in rows]}
@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+"""Servicio KPI en proceso.
+
+`execute_kpi` es el cuerpo de POST /query: resuelve la función contra
+kpi_function_map (DWH, con caché) o contra los fallbacks CSV, y lo usan
+tanto el endpoint como /daily_report sin pasar por HTTP.
+`execute_kpi_batch` es el cuerpo de POST /query/batch: varias funciones en
+una sola llamada, en paralelo sobre el pool. `execute_kpi_page` y
+`stream_kpi` sirven /query paginado (limit + cursor) y en NDJSON sin
+materializar el resultado entero.
+"""
+
+import os
+import asyncio
+from datetime import date
+from typing import Optional
+
+import httpx
+import pandas as pd
+
+from db import DB_BACKEND, DB_POOL_MAX_SIZE, fetch_function, fetch_function_page_async, stream_function
+from services.weather import weather_flight
+from store.datasets import ORDINAL_COLUMNS, day_ordinal, registry as datasets
+from services.kpi_cache import kpi_cache, make_key, ttl_for
+from services.encoding import SHAPES, frame_payload, rows_payload
+from services.rollup import iso_week_ordinal, parse_rollup, rollup
+from services.paging import (InvalidCursor, decode_cursor, encode_cursor, page_size,
+                             frame_ndjson, rows_ndjson, rows_ndjson_async)
+
+KPI_BATCH_MAX_ITEMS = int(os.getenv("KPI_BATCH_MAX_ITEMS", "50"))
+# como mucho una consulta por conexión del pool a la vez
+KPI_BATCH_CONCURRENCY = int(os.getenv("KPI_BATCH_CONCURRENCY", str(DB_POOL_MAX_SIZE)))
+
+# "ttl" (opcional): segundos de caché del resultado {"closed": periodo ya cerrado, "open": periodo en curso}
+kpi_function_map = {
+    "fn_weekly_avg_ticket_by_venue": {
+        "args": ["p_company_name", "p_week_number", "p_year"]
+    },
+    "fn_estimated_profit_by_company_and_period": {
+        "args": ["p_company_name", "p_year", "p_week_number", "p_month_number"]
+    },
+    "fn_estimated_profit_by_venue_and_period": {
+        "args": ["p_company_name", "p_venue_name", "p_year", "p_week_number", "p_month_number"]
+    },
+    "fn_estimated_profit_by_venues_and_week": {
+        "args": ["p_company_name", "p_year", "p_week_number"]
+    },
+    "fn_personnel_expense_ratio": {
+        "args": ["p_company_name", "p_year", "p_venue_name","p_week_number", "p_month_number"]
+    },
+    "fn_total_income_by_period": {
+        "args": ["p_company_name", "p_year", "p_week_number", "p_month_number"]
+    },
+    "fn_week_total_attendees": {
+        "args": ["p_company_name", "p_week_number", "p_year"]
+    },
+    "fn_weekly_attendance_by_venue": {
+        "args": ["p_company_name", "p_week_number", "p_year"],
+        "ttl": {"closed": 7 * 24 * 3600, "open": 300}
+    },
+    "fn_weekly_avg_income_per_attendee": {
+        "args": ["p_company_name", "p_week_number", "p_year"]
+    },
+    "fn_weekly_sales_comparison_by_section": {
+        "args": ["p_company_name", "p_week_number", "p_year"]
+    },
+    "fn_weekly_venues_income": {
+        "args": ["p_company_name", "p_week_number", "p_year", "p_month_number"],
+        "ttl": {"closed": 7 * 24 * 3600, "open": 300}
+    },
+    "get_debit_variation_by_company_and_period": {
+        "args": ["p_company_name", "p_week_number", "p_year", "p_month_number"]
+    },
+    "get_debit_variation_by_venue_and_period": {
+        "args": ["p_company_name", "p_venue_name", "p_year","p_week_number", "p_month_number"]
+    },
+    "get_venue_income_by_period": {
+        "args": ["p_company_name", "p_venue_name" , "p_year", "p_week_number", "p_month_number"]
+    },
+    "fn_personnel_expense_ratio2": {
+        "args": ["p_company_name", "p_venue_name", "p_year", "p_week_number", "p_month_number"]
+    },
+    "fn_weekly_total_income_no_digital": {
+        "args": ["p_company_name", "p_week_number", "p_year"]
+    },
+    "fn_weekly_venues_income_no_digital": {
+        "args": ["p_company_name", "p_week_number", "p_year"]
+    },
+    ".get_departmental_expenses": {
+        "args": ["p_company_name", "p_year", "p_month_number"]
+    }
+    }
+
+async def handle_weather_forecast(params: dict):
+
+    city = str(params.get("p_venue_name") or params.get("p_city") or "").strip()
+
+    if not city:
+        return {
+            "error": "Faltan parámetros requeridos: p_venue_name/p_city"
+        }
+
+    start_date_str = params.get("p_start_date")
+    end_date_str = params.get("p_end_date")
+
+    if not start_date_str:
+        today_iso      = date.today().isoformat()
+        start_date_str = today_iso
+        end_date_str   = today_iso
+    elif not end_date_str:
+        # Si solo falta end_date, lo igualamos a start_date
+        end_date_str   = start_date_str
+
+    start_dt = pd.to_datetime(start_date_str).date()
+    end_dt   = pd.to_datetime(end_date_str).date()
+
+    start_iso = start_dt.isoformat()
+    end_iso   = end_dt.isoformat()
+
+    rows = await weather_flight.fetch(city, start_iso, end_iso)
+
+    return {"result": "success", "data": rows}
+
+def _parse_day(value) -> date:
+    return date.fromisoformat(str(value).strip()[:10])
+
+def _day_window(params, week_start, week_end):
+    """(lo, hi) en ordinales de día para from_date/to_date o p_year + semanas ISO.
+
+    Con week_end < week_start el rango sigue en las semanas del año siguiente.
+    Sin semanas es el año natural p_year entero. Sin fechas ni p_year es un
+    error: las semanas sueltas no dicen de qué año son.
+    """
+    if params.get("from_date") or params.get("to_date"):
+        lo = day_ordinal(_parse_day(params["from_date"])) if params.get("from_date") else None
+        hi = day_ordinal(_parse_day(params["to_date"])) if params.get("to_date") else None
+        return lo, hi
+    if params.get("p_year") is None:
+        raise ValueError("Falta p_year (o from_date / to_date)")
+    year = int(params.get("p_year"))
+    if week_start is None:
+        return day_ordinal(date(year, 1, 1)), day_ordinal(date(year, 12, 31))
+    week_start = int(week_start)
+    week_end = int(week_end) if week_end is not None else week_start
+    first = date.fromisocalendar(year, week_start, 1)
+    last = date.fromisocalendar(year if week_end >= week_start else year + 1, week_end, 7)
+    return day_ordinal(first), day_ordinal(last)
+
+def _public(frame):
+    return frame.drop(columns=ORDINAL_COLUMNS)
+
+def _reservas_weeks(params):
+    return params.get("p_week_number"), params.get("p_week_number_end")
+
+def _stock_weeks(params):
+    if params.get("p_week_number") is not None:
+        return params.get("p_week_number"), params.get("p_week_number")
+    if params.get("p_week_start") is not None and params.get("p_week_end") is not None:
+        return params.get("p_week_start"), params.get("p_week_end")
+    return None, None
+
+def _reservas_by_weeks(index, key, params):
+    """Reservas de `key` para from_date/to_date o p_year / p_week_number[..p_week_number_end]."""
+    lo, hi = _day_window(params, *_reservas_weeks(params))
+    return _public(index.range(*key, lo=lo, hi=hi))
+
+def _stock_by_weeks(index, key, params):
+    """Stock de `key` para from_date/to_date o p_year y p_week_number o p_week_start..p_week_end."""
+    lo, hi = _day_window(params, *_stock_weeks(params))
+    return _public(index.range(*key, lo=lo, hi=hi))
+
+def _sales_week_window(params):
+    """(lo, hi) en semanas ISO: p_week_number de p_year, o todas las semanas de p_year."""
+    if params.get("p_year") is None:
+        raise ValueError("Falta p_year")
+    year = int(params.get("p_year"))
+    if params.get("p_week_number") is not None:
+        week = iso_week_ordinal(year, int(params.get("p_week_number")))
+        return week, week
+    return iso_week_ordinal(year, 1), iso_week_ordinal(year, date(year, 12, 28).isocalendar().week)
+
+# fallback -> (dataset, filtra por venue) para group_by / agg
+_ROLLUP_SOURCES = {
+    "reservas_synthetic_by_week": ("reservas", False),
+    "reservas_synthetic_by_venue": ("reservas", True),
+    "stock_synthetic_by_week": ("stock", False),
+    "stock_synthetic_by_venue": ("stock", True),
+    "cogs_synthetic_by_week": ("sales", False),
+    "cogs_synthetic_by_venue": ("sales", True),
+}
+
+def _rollup_frame(fn_name, params, group_by, aggs):
+    if fn_name not in _ROLLUP_SOURCES:
+        raise ValueError(f"{fn_name} no admite group_by / agg")
+    dataset, by_venue = _ROLLUP_SOURCES[fn_name]
+    company = params.get("p_company_name")
+    venue = params.get("p_venue_name") if by_venue else None
+    if dataset == "sales":
+        lo, hi = _sales_week_window(params)
+        return rollup(dataset, company, venue, lo, hi, group_by, aggs, unit="week")
+    weeks = _reservas_weeks(params) if dataset == "reservas" else _stock_weeks(params)
+    lo, hi = _day_window(params, *weeks)
+    return rollup(dataset, company, venue, lo, hi, group_by, aggs)
+
+# funciones que resuelve fallback_to_csv
+CSV_FALLBACK_FUNCTIONS = frozenset({
+    "cash_flow_synthetic_by_week", "cash_flow_synthetic_by_venue",
+    "cogs_synthetic_by_venue", "cogs_synthetic_by_week",
+    "ebitda_synthetic_by_month", "ebitda_synthetic_by_venue",
+    "reservas_synthetic_by_week", "reservas_synthetic_by_venue",
+    "stock_synthetic_by_week", "stock_synthetic_by_venue",
+})
+
+def fallback_frame(fn_name, params):
+    """DataFrame del fallback CSV de fn_name (None si no hay fallback para esa función).
+
+    Con group_by / agg en params devuelve el rollup (ver services.rollup) en vez de las filas.
+    """
+    rollup_spec = parse_rollup(params)
+    if rollup_spec is not None and fn_name in CSV_FALLBACK_FUNCTIONS:
+        return _rollup_frame(fn_name, params, *rollup_spec)
+
+    #lee los csv sintéticos (índices precalculados en store.datasets)
+    if fn_name == "cash_flow_synthetic_by_week":
+        filtered = datasets.index("cashflow", "by_week").get(params.get("p_year"), params.get("p_week_number"))
+        cols_income = [c for c in filtered.columns if c.endswith("_income_predicted")]
+        result_df = filtered[["p_venue_name", "p_year", "p_week_number"] + cols_income]
+        
+        return result_df
+
+    elif fn_name == "cash_flow_synthetic_by_venue":
+        filtered = datasets.index("cashflow", "by_venue").get(
+            params.get("p_venue_name"), params.get("p_year"), params.get("p_week_number"))
+        cols_income = [c for c in filtered.columns if c.endswith("_income_predicted")]
+        result_df = filtered[["p_venue_name", "p_year", "p_week_number"] + cols_income]
+        return result_df
+
+    elif fn_name == "cogs_synthetic_by_venue":
+        filtered = datasets.index("sales", "by_venue").get(
+            params.get("p_company_name"), params.get("p_year"), params.get("p_venue_name"))
+        return filtered
+
+    elif fn_name == "cogs_synthetic_by_week":
+        filtered = datasets.index("sales", "by_week").get(
+            params.get("p_company_name"), params.get("p_year"), params.get("p_week_number"))
+        return filtered
+
+
+    elif fn_name == "ebitda_synthetic_by_month":
+        filtered = datasets.index("ebitda", "by_month").get(
+            params.get("p_company_name"), params.get("p_year"), params.get("p_month_number"))
+        return filtered
+
+    elif fn_name == "ebitda_synthetic_by_venue":
+        filtered = datasets.index("ebitda", "by_venue").get(
+            params.get("p_company_name"), params.get("p_year"), params.get("p_venue_name"))
+        return filtered
+
+    elif fn_name == "reservas_synthetic_by_week":
+        # Tramo por compañía ordenado por día: cualquier rango es un solo slice
+        filtered = _reservas_by_weeks(datasets.index("reservas", "by_day"),
+                                      (params.get("p_company_name"),), params)
+        return filtered
+        
+    elif fn_name == "reservas_synthetic_by_venue":
+        # Tramo por compañía y venue ordenado por día
+        filtered = _reservas_by_weeks(datasets.index("reservas", "by_venue_day"),
+                                      (params.get("p_company_name"), params.get("p_venue_name")), params)
+        return filtered
+
+
+    elif fn_name == "stock_synthetic_by_week":
+        filtered = _stock_by_weeks(datasets.index("stock", "by_day"),
+                                   (params.get("p_company_name"),), params)
+        return filtered
+
+    elif fn_name == "stock_synthetic_by_venue":
+        filtered = _stock_by_weeks(datasets.index("stock", "by_venue_day"),
+                                   (params.get("p_company_name"), params.get("p_venue_name")), params)
+        return filtered
+        
+    return None
+
+def fallback_to_csv(fn_name, params, shape="records"):
+    frame = fallback_frame(fn_name, params)
+    if frame is None:
+        # Si no encontramos el KPI ni en CSV
+        return {"result": "error", "message": f"No data found for {fn_name}"}
+    return {"result": "success", "data": frame_payload(frame, shape)}
+
+
+def _check_shape(shape):
+  if shape not in SHAPES:
+      raise ValueError(f"shape debe ser uno de {', '.join(SHAPES)}")
+
+async def execute_kpi(fn_name: str, params: dict, shape: str = "records"):
+  """Ejecuta un KPI como POST /query y devuelve el mismo dict de respuesta.
+
+  shape="columns" devuelve data como {"columns", "rows"} en vez de una lista de objetos.
+  """
+  params = params or {}
+  try:
+    _check_shape(shape)
+  except ValueError as e:
+    return {"result": "error", "message": str(e)}
+
+  if fn_name == "weather_forecast":
+      res = await handle_weather_forecast(params)
+      if "data" in res:
+          res["data"] = rows_payload(res["data"], shape)
+      return res
+
+  try:
+    print("🔵 Parámetros recibidos:", params)
+    print("🔵 Función solicitada:", fn_name)
+
+    fn_info = kpi_function_map.get(fn_name)
+    if not fn_info:
+        print(f"[WARM] Función {fn_name} no está en el mapa, activando fallback")
+        return await asyncio.to_thread(fallback_to_csv, fn_name, params, shape)
+        
+    arg_names = fn_info["args"]
+    args = [params.get(arg) for arg in arg_names]
+    
+    print(f"🟢 Ejecutando: dwh.{fn_name} ({DB_BACKEND})")
+    print("📦 Con args:", args)
+    
+    # asyncpg nativo o psycopg2 del pool en un thread; la conexión vuelve al pool en cualquier caso.
+    # Resultados cacheados por (función, args) y peticiones idénticas concurrentes agrupadas
+    result = await kpi_cache.get_or_load(
+        make_key(fn_name, args), ttl_for(fn_info, params), lambda: fetch_function(fn_name, args))
+    
+    print("bien, consulta bien")
+
+    if result:
+        return {"result": "success", "data": rows_payload(result, shape)}
+
+    print(f"[WARN] No hay datos en DWH para {fn_name}, activando fallback CSV")
+      
+    return await asyncio.to_thread(fallback_to_csv, fn_name, params, shape)
+    
+  except Exception as e:
+    print("error al ejecutar", e)
+    return {"status": "error", "message": str(e)}
+
+async def execute_kpi_page(fn_name: str, params: dict, limit, cursor: Optional[str] = None,
+                           shape: str = "records"):
+  """Una página de execute_kpi: hasta `limit` filas desde `cursor` y `next_cursor` si quedan más."""
+  params = params or {}
+  try:
+    _check_shape(shape)
+    limit = page_size(limit)
+    offset = decode_cursor(cursor, fn_name, params) if cursor else 0
+  except (InvalidCursor, ValueError) as e:
+    return {"result": "error", "message": str(e)}
+
+  try:
+    fn_info = kpi_function_map.get(fn_name)
+    if not fn_info:
+        frame = await asyncio.to_thread(fallback_frame, fn_name, params)
+        if frame is None:
+            return {"result": "error", "message": f"No data found for {fn_name}"}
+        page = frame.iloc[offset:offset + limit + 1]
+        more = len(page) > limit
+        data = await asyncio.to_thread(frame_payload, page.iloc[:limit], shape)
+    else:
+        args = [params.get(arg) for arg in fn_info["args"]]
+        # cursor de servidor: solo viajan las filas de la página
+        rows = await fetch_function_page_async(fn_name, args, offset, limit)
+        if not rows and offset == 0:
+            print(f"[WARN] No hay datos en DWH para {fn_name}, activando fallback CSV")
+            return await asyncio.to_thread(fallback_to_csv, fn_name, params, shape)
+        more = len(rows) > limit
+        data = rows_payload(rows[:limit], shape)
+  except Exception as e:
+    print("error al ejecutar", e)
+    return {"status": "error", "message": str(e)}
+
+  return {
+      "result": "success",
+      "data": data,
+      "next_cursor": encode_cursor(fn_name, params, offset + limit) if more else None,
+  }
+
+_END = object()
+
+async def stream_kpi(fn_name: str, params: dict):
+  """Iterador de líneas NDJSON con las filas de fn_name, o un dict de error si falla antes de empezar."""
+  params = params or {}
+  try:
+    fn_info = kpi_function_map.get(fn_name)
+    if not fn_info:
+        frame = await asyncio.to_thread(fallback_frame, fn_name, params)
+        if frame is None:
+            return {"result": "error", "message": f"No data found for {fn_name}"}
+        return frame_ndjson(frame)
+
+    args = [params.get(arg) for arg in fn_info["args"]]
+    rows = stream_function(fn_name, args)
+    # la primera fila se pide aquí para que un error de conexión o de la función
+    # llegue como JSON y no como una respuesta cortada
+    if DB_BACKEND == "asyncpg":
+        first = await anext(rows, _END)
+        return _chain_async(first, rows)
+    first = await asyncio.to_thread(next, rows, _END)
+    return _chain(first, rows)
+  except Exception as e:
+    print("error al ejecutar", e)
+    return {"status": "error", "message": str(e)}
+
+def _chain(first, rows):
+  if first is not _END:
+      yield from rows_ndjson([first])
+      yield from rows_ndjson(rows)
+
+async def _chain_async(first, rows):
+  if first is not _END:
+      async for line in rows_ndjson_async(_prepend(first, rows)):
+          yield line
+
+async def _prepend(first, rows):
+  yield first
+  async for row in rows:
+      yield row
+
+async def query_kpi(fn_name: str, params: dict, url: Optional[str] = None):
+  """execute_kpi en proceso, o POST {url}/query si `url` apunta a otro backend."""
+  if not url:
+      return await execute_kpi(fn_name, params)
+
+  async with httpx.AsyncClient(timeout=30) as client:
+      response = await client.post(f"{url.rstrip('/')}/query", json={"function": fn_name, "params": params})
+  response.raise_for_status()
+  return response.json()
+
+def _batch_item_error(item) -> Optional[str]:
+  if not isinstance(item, dict):
+      return "Cada elemento debe ser un objeto {function, params}"
+  fn_name = item.get("function")
+  if not isinstance(fn_name, str) or not fn_name:
+      return "Falta 'function'"
+  if fn_name != "weather_forecast" and fn_name not in kpi_function_map and fn_name not in CSV_FALLBACK_FUNCTIONS:
+      return f"Función desconocida: {fn_name}"
+  if item.get("params") is not None and not isinstance(item.get("params"), dict):
+      return "'params' debe ser un objeto"
+  return None
+
+async def _batch_item(item, limit: asyncio.Semaphore, shape: str) -> dict:
+  error = _batch_item_error(item)
+  fn_name = item.get("function") if isinstance(item, dict) else None
+  if error:
+      return {"function": fn_name, "status": "error", "message": error}
+  async with limit:
+      try:
+          res = await execute_kpi(fn_name, item.get("params") or {}, shape)
+      except Exception as e:
+          res = {"status": "error", "message": str(e)}
+  ok = res.get("result") == "success"
+  body = {k: v for k, v in res.items() if k not in ("result", "status")}
+  if not ok and "error" in body:
+      body["message"] = body.pop("error")
+  return {"function": fn_name, "status": "success" if ok else "error", **body}
+
+async def execute_kpi_batch(items: list, shape: str = "records") -> dict:
+  """Ejecuta varias funciones a la vez; un resultado por elemento, en el mismo orden."""
+  if not isinstance(items, list) or not items:
+      return {"result": "error", "message": "Se espera una lista no vacía de {function, params}"}
+  if len(items) > KPI_BATCH_MAX_ITEMS:
+      return {"result": "error", "message": f"Máximo {KPI_BATCH_MAX_ITEMS} funciones por batch"}
+
+  limit = asyncio.Semaphore(KPI_BATCH_CONCURRENCY)
+  results = await asyncio.gather(*(_batch_item(item, limit, shape) for item in items))
+  return {
+      "result": "success",
+      "results": results,
+      "errors": sum(1 for r in results if r["status"] == "error"),
+  }
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Caché TTL/LRU para los resultados de las funciones KPI del DWH.
+
+- clave: (nombre de función, args normalizados)
+- TTL por función: `"ttl": {"closed": s, "open": s}` en kpi_function_map;
+  "closed" aplica cuando el periodo pedido (semana/mes/año) ya terminó y
+  "open" cuando incluye hoy o es futuro. Un TTL de 0 desactiva la caché.
+- memoria acotada por número de entradas y tamaño aproximado, con
+  expulsión LRU
+- single-flight: si varias peticiones idénticas fallan a la vez, solo una
+  va al DWH y el resto espera su resultado; la carga es una tarea aparte, así
+  que cancelar a un llamante no cancela la carga de los demás
+
+Vive en el event loop (sin locks): usar solo desde código async.
+"""
+
+import os
+import json
+import time
+import asyncio
+import calendar
+from collections import OrderedDict
+from datetime import date
+from typing import Awaitable, Callable, Optional
+
+KPI_CACHE_MAX_ENTRIES = int(os.getenv("KPI_CACHE_MAX_ENTRIES", "1024"))
+KPI_CACHE_MAX_BYTES = int(os.getenv("KPI_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+DEFAULT_TTL = {
+    "closed": int(os.getenv("KPI_CACHE_TTL_CLOSED", str(24 * 3600))),
+    "open": int(os.getenv("KPI_CACHE_TTL_OPEN", "120")),
+}
+
+def _normalize_arg(value):
+    if isinstance(value, str):
+        value = value.strip()
+        if value.isdigit():
+            return int(value)
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def make_key(fn_name: str, args: list) -> tuple:
+    return (fn_name, tuple(_normalize_arg(a) for a in args))
+
+def period_is_closed(params: dict, today: Optional[date] = None) -> bool:
+    """True si la semana/mes/año de los params terminó antes de hoy."""
+    today = today or date.today()
+    try:
+        year = int(params.get("p_year")) if params.get("p_year") is not None else None
+        week = int(params.get("p_week_number")) if params.get("p_week_number") is not None else None
+        month = int(params.get("p_month_number")) if params.get("p_month_number") is not None else None
+        if year is None:
+            return False
+        if week is not None:
+            period_end = date.fromisocalendar(year, week, 7)
+        elif month is not None:
+            period_end = date(year, month, calendar.monthrange(year, month)[1])
+        else:
+            period_end = date(year, 12, 31)
+    except (TypeError, ValueError):
+        return False
+    return period_end < today
+
+def ttl_for(fn_info: dict, params: dict) -> int:
+    ttl = {**DEFAULT_TTL, **fn_info.get("ttl", {})}
+    return ttl["closed"] if period_is_closed(params) else ttl["open"]
+
+def _estimate_size(value) -> int:
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 1024
+
+class KpiResultCache:
+    def __init__(self, max_entries: int = KPI_CACHE_MAX_ENTRIES, max_bytes: int = KPI_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, value, size)
+        self._inflight: dict = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    async def get_or_load(self, key: tuple, ttl: int, loader: Callable[[], Awaitable]):
+        if ttl <= 0:
+            return await loader()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._remove(key)
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        # la carga va en su propia tarea y todos (también quien la lanza) la esperan con shield:
+        # si un llamante se cancela (p. ej. timeout de una etapa del report) los demás siguen esperando
+        task = asyncio.create_task(self._load(key, ttl, loader))
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    async def _load(self, key: tuple, ttl: int, loader: Callable[[], Awaitable]):
+        value = await loader()
+        self._store(key, value, ttl)
+        return value
+
+    def _done(self, key: tuple, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # los llamantes ya la reciben; evita el aviso si todos se cancelaron
+
+    def _store(self, key, value, ttl):
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, value, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def flush(self, fn_name: Optional[str] = None) -> int:
+        """Vacía la caché (o solo las entradas de fn_name); devuelve cuántas se borraron."""
+        keys = [k for k in self._entries if fn_name is None or k[0] == fn_name]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+        }
+
+kpi_cache = KpiResultCache()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Paginación por cursor opaco y streaming NDJSON para /query.
+
+El cursor es base64 de {función, huella de los params, offset}: el cliente
+solo lo devuelve tal cual para pedir la página siguiente, y un cursor de
+otra consulta se rechaza en vez de devolver filas de otra cosa.
+"""
+
+import os
+import json
+import base64
+import hashlib
+
+from services.encoding import dumps, frame_payload
+
+QUERY_MAX_PAGE_SIZE = int(os.getenv("QUERY_MAX_PAGE_SIZE", "5000"))
+# filas por trozo al serializar DataFrames en streaming
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "1000"))
+
+class InvalidCursor(ValueError):
+    pass
+
+def _fingerprint(fn_name: str, params: dict) -> str:
+    raw = json.dumps([fn_name, params], sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+def encode_cursor(fn_name: str, params: dict, offset: int) -> str:
+    payload = json.dumps({"f": _fingerprint(fn_name, params), "o": offset}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(token: str, fn_name: str, params: dict) -> int:
+    """Offset guardado en el cursor; InvalidCursor si está mal o es de otra consulta."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        offset = int(payload["o"])
+        fingerprint = payload["f"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor("cursor no válido") from e
+    if fingerprint != _fingerprint(fn_name, params) or offset < 0:
+        raise InvalidCursor("el cursor no corresponde a esta consulta")
+    return offset
+
+def page_size(limit) -> int:
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError("limit debe ser un entero") from None
+    if limit <= 0:
+        raise ValueError("limit debe ser mayor que 0")
+    return min(limit, QUERY_MAX_PAGE_SIZE)
+
+def ndjson_line(row: dict) -> bytes:
+    return dumps(row) + b"\n"
+
+def frame_ndjson(frame):
+    """Líneas NDJSON de un DataFrame, convirtiendo a dicts solo un trozo cada vez."""
+    for start in range(0, len(frame), STREAM_CHUNK_ROWS):
+        for row in frame_payload(frame.iloc[start:start + STREAM_CHUNK_ROWS]):
+            yield ndjson_line(row)
+
+def rows_ndjson(rows):
+    for row in rows:
+        yield ndjson_line(dict(row))
+
+async def rows_ndjson_async(rows):
+    async for row in rows:
+        yield ndjson_line(row)
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""Montaje de los daily reports por venue.
+
+Cada fuente (KPIs del DWH, reservas, stock, frase, eventos, clima y
+predicción de caja) es una etapa async independiente con su propio
+timeout y un valor degradado si falla; todas se lanzan a la vez, así que
+la latencia la marca la etapa más lenta y no la suma de todas. Las etapas
+que acaban degradadas se listan en `degraded` de la respuesta; un venue
+cuyo clima sale del último dato conocido (o no tiene) lleva
+`weather_stale` y no se guarda como snapshot.
+
+Las etapas trabajan sobre una lista de venues: las entradas compartidas
+(KPIs de toda la compañía, semana de stock/caja, reservas y eventos del día)
+se obtienen una vez y se reparten por venue en una sola pasada, así que un
+report de un venue y el batch de todos siguen el mismo camino.
+"""
+
+import os
+import asyncio
+import calendar
+from datetime import date, timedelta
+from typing import Optional
+
+from ingest.daily import DEFAULT_VENUES
+
+from store.datasets import day_ordinal, registry as datasets
+from store.weather import weather_store
+from store.report_snapshots import report_snapshots
+from services.encoding import dumps
+from services.weather import weather_flight
+from services.kpi import query_kpi
+
+COMPANY = "PALLAPIZZA"
+
+# segundos por etapa
+KPI_STAGE_TIMEOUT = float(os.getenv("REPORT_KPI_TIMEOUT", "15"))
+WEATHER_STAGE_TIMEOUT = float(os.getenv("REPORT_WEATHER_TIMEOUT", "10"))
+LOCAL_STAGE_TIMEOUT = float(os.getenv("REPORT_LOCAL_TIMEOUT", "5"))
+
+DEFAULT_PHRASE = "¡Ánimo! Hoy es un gran día para intentarlo."
+
+# etapas que, degradadas, dejan valores de relleno (0 / None) en kpi_data
+KPI_STAGES = ("income", "attendance", "reservas", "cash_flow")
+
+def get_weekday_label(dt:date):
+  return calendar.day_abbr[dt.weekday()].lower()
+
+def get_weekday_number(dt:date):
+  return dt.weekday()
+
+def generar_frase_clima(clima):
+    if clima:
+        if "rain" in clima or "lluvia" in clima:
+            return "Parece que lloverá ☔, tenlo en cuenta para las reservas."
+        elif "sun" in clima or "despejado" in clima:
+            return "¡Día soleado! La terraza seguro que se llena. ☀️"
+        elif "cloud" in clima or "nublado" in clima:
+            return "Día nublado, perfecto para comer algo caliente."
+        else:
+            return f"El clima de hoy es {clima}."
+    return "No tengo información del clima para hoy."
+
+async def ingest_one_day(city: str, date_str: str):
+    rows = await weather_flight.fetch(city, date_str)
+    if not rows:
+        raise RuntimeError(f"No se obtuvieron datos para {city} {date_str}")
+
+async def _run_stage(name: str, coro, timeout: float, fallback, degraded: list):
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except Exception as e:
+        print(f"⚠️ [report] Etapa '{name}' degradada: {e!r}")
+        degraded.append(name)
+        return fallback
+
+async def _kpi_rows(fn_name: str, params: dict, url: Optional[str]):
+    res = await query_kpi(fn_name, params, url)
+    if "data" not in res:
+        raise RuntimeError(res.get("message") or f"{fn_name} sin datos")
+    return res["data"]
+
+def _find_venue(rows, venue_name):
+    return next((item for item in rows if item["venue_name"].upper() == venue_name.upper()), None)
+
+def _by_venue(venues, default):
+    return {venue: default() for venue in venues}
+
+# --- etapas síncronas (pandas): se ejecutan en un thread, un valor por venue ---
+
+def _reservas_stage(venues, target_date):
+    # por fecha y no por (p_year, p_week_number): la semana ISO 1 puede empezar en diciembre
+    day = day_ordinal(target_date)
+    index = datasets.index("reservas", "by_venue_day")
+    result = {}
+    for venue in venues:
+        rows = index.range(COMPANY, venue, lo=day, hi=day)
+        result[venue] = int(rows["reservations"].iloc[0]) if len(rows) else 0
+    return result
+
+def _stock_stage(venues, target_date):
+    # alertas precalculadas al cargar el stock: solo se corta la semana ISO de cada venue
+    monday = target_date - timedelta(days=target_date.weekday())
+    lo = day_ordinal(monday)
+    return datasets.index("stock", "alerts").buckets(COMPANY, venues, lo, lo + 6)
+
+def _motivation_stage(target_date, lang, tone):
+    try:
+        phrase = datasets.index("motivation", "lookup").pick(str(target_date), lang, tone)
+    except FileNotFoundError:
+        return DEFAULT_PHRASE
+    return DEFAULT_PHRASE if phrase is None else phrase["text"]
+
+def _events_stage(venues, date_str):
+    result = _by_venue(venues, lambda: ([], False))
+    try:
+        events = datasets.index("events", "lookup")
+    except FileNotFoundError:
+        return result
+    # índice (fecha, ciudad normalizada): un acceso a dict por venue
+    for venue in venues:
+        rows = events.on(date_str, venue)
+        result[venue] = (rows["title"].tolist(), any(rows["has_football"].astype(str) == "1"))
+    return result
+
+def _find_weather(venues, date_str):
+    """{venue: fila de clima o None}"""
+    return {venue: weather_store.lookup(venue, date_str) for venue in venues}
+
+def _cashflow_stage(venues, year, week_number, weekday_label_full):
+    cashflow_df = datasets.index("cashflow", "by_week").get(year, week_number)
+    daily_income_col = f"{weekday_label_full}_income_predicted"
+    result = _by_venue(venues, lambda: None)
+    if daily_income_col not in cashflow_df.columns:
+        return result
+    predicted = dict(zip(cashflow_df["p_venue_name"].astype(str).str.upper(), cashflow_df[daily_income_col]))
+    for venue in venues:
+        if venue.upper() in predicted:
+            result[venue] = float(predicted[venue.upper()])
+    return result
+
+# --- etapas async ---
+
+def _weather_summary(row):
+    clima = str(row["conditions"]).lower()
+    return clima, row["temp"], generar_frase_clima(clima)
+
+def _last_known_weather(venues, date_str):
+    return {venue: weather_store.last_known(venue, date_str) for venue in venues}
+
+async def _weather_stage(venues, date_str, stale: set):
+    """Clima por venue; los venues sin clima del día (último conocido o nada) se añaden a `stale`."""
+    found = await asyncio.to_thread(_find_weather, venues, date_str)
+    missing = [venue for venue, row in found.items() if row is None]
+    errors, last_known = {}, {}
+    if missing:
+        # con el circuit breaker abierto ingest_one_day falla al instante
+        results = await asyncio.gather(*(ingest_one_day(venue, date_str) for venue in missing),
+                                       return_exceptions=True)
+        errors = {venue: res for venue, res in zip(missing, results) if isinstance(res, Exception)}
+        found.update(await asyncio.to_thread(_find_weather, missing, date_str))
+        if errors:
+            last_known = await asyncio.to_thread(_last_known_weather, [v for v in errors if found[v] is None],
+                                                 date_str)
+
+    result = {}
+    for venue in venues:
+        if found[venue] is not None:
+            result[venue] = _weather_summary(found[venue])
+            continue
+        stale.add(venue)
+        if last_known.get(venue) is not None:
+            row = last_known[venue]
+            clima, temperatura, frase = _weather_summary(row)
+            result[venue] = (clima, temperatura, f"{frase} (último dato disponible: {row['date']})")
+        elif venue in errors:
+            result[venue] = (None, None, f"No se pudo ingestar clima: {errors[venue]}")
+        else:
+            result[venue] = (None, None, "No tengo información del clima para hoy.")
+    return result
+
+def _venue_report(venue_name, stages, degraded, weather_stale, weekday_label, weekday_label_full):
+    (income_rows, attendance_rows, reservas, stock, phrase, events, weather, cashflow) = stages
+
+    #kpi_data: last_year_{weekday} as objective
+    if income_rows is not None:
+        venue_data = _find_venue(income_rows, venue_name)
+        if venue_data is None:
+            return {"error": "Venue not found"}
+        target_income = venue_data.get(f"last_year_{weekday_label_full}", 0)
+    else:
+        target_income = 0
+
+    attendance_row = _find_venue(attendance_rows, venue_name)
+    if attendance_row:
+        attendance_last = attendance_row.get(f"{weekday_label}_prev", 0)
+        current_attendance = int(attendance_last * 1.1)
+        if attendance_last > 0:
+            attendance_variation = ((current_attendance - attendance_last) / attendance_last) * 100
+        else:
+            attendance_variation = 0.0
+    else:
+        attendance_last = 0
+        attendance_variation = 0
+
+    daily_income_predicted = cashflow[venue_name]
+    if daily_income_predicted is not None and target_income and target_income > 0:
+        daily_income_var = round(((daily_income_predicted - float(target_income)) / float(target_income)) * 100, 2)
+    else:
+        daily_income_var = None
+
+    productos_bajo_stock, productos_medio_stock = stock[venue_name]
+    fechas_importantes, hay_futbol = events[venue_name]
+    clima, temperatura, frase_clima = weather[venue_name]
+    return {
+        "result": "success",
+        "kpi_data": {
+            "objective": target_income,
+            "prediction": daily_income_predicted,
+            "prediction_var": daily_income_var,
+            "attendance_last": attendance_last,
+            "attendance_variation": attendance_variation,
+            "num_reservas": reservas[venue_name]
+        },
+        "synthetic_data": {
+            "productos_bajo_stock": productos_bajo_stock,
+            "productos_medio_stock": productos_medio_stock,
+            "fechas_importantes": fechas_importantes,
+            "clima": clima,
+            "temperatura": temperatura,
+            "frase_clima": frase_clima,
+            "frase_motivacional": phrase,
+            "hay_futbol": hay_futbol
+        },
+        "degraded": degraded,
+        "weather_stale": weather_stale
+    }
+
+async def build_daily_reports(venues: Optional[list[str]], target_date: date, lang: str = "es",
+                              tone: str = "funny", url: Optional[str] = None) -> dict:
+    """{venue: report} con todas las entradas compartidas obtenidas una sola vez."""
+    venues = list(dict.fromkeys(venues or DEFAULT_VENUES))
+    year = target_date.year
+    week_number = target_date.isocalendar().week
+    weekday_label = get_weekday_label(target_date)  # 'mon', 'tue', etc.
+    weekday_label_full = target_date.strftime("%A").lower()
+    date_str = target_date.isoformat()
+    kpi_params = {"p_company_name": COMPANY, "p_year": year, "p_week_number": week_number}
+
+    degraded, stale_weather = [], set()
+    stages = await asyncio.gather(
+        _run_stage("income", _kpi_rows("fn_weekly_venues_income", kpi_params, url),
+                   KPI_STAGE_TIMEOUT, None, degraded),
+        _run_stage("attendance", _kpi_rows("fn_weekly_attendance_by_venue", kpi_params, url),
+                   KPI_STAGE_TIMEOUT, [], degraded),
+        _run_stage("reservas", asyncio.to_thread(_reservas_stage, venues, target_date),
+                   LOCAL_STAGE_TIMEOUT, _by_venue(venues, lambda: 0), degraded),
+        _run_stage("stock", asyncio.to_thread(_stock_stage, venues, target_date),
+                   LOCAL_STAGE_TIMEOUT, _by_venue(venues, lambda: ([], [])), degraded),
+        _run_stage("motivation", asyncio.to_thread(_motivation_stage, target_date, lang, tone),
+                   LOCAL_STAGE_TIMEOUT, DEFAULT_PHRASE, degraded),
+        _run_stage("events", asyncio.to_thread(_events_stage, venues, date_str),
+                   LOCAL_STAGE_TIMEOUT, _by_venue(venues, lambda: ([], False)), degraded),
+        _run_stage("weather", _weather_stage(venues, date_str, stale_weather), WEATHER_STAGE_TIMEOUT,
+                   _by_venue(venues, lambda: (None, None, "No tengo información detallada del clima.")), degraded),
+        _run_stage("cash_flow", asyncio.to_thread(_cashflow_stage, venues, year, week_number, weekday_label_full),
+                   LOCAL_STAGE_TIMEOUT, _by_venue(venues, lambda: None), degraded),
+    )
+    return {venue: _venue_report(venue, stages, degraded, venue in stale_weather, weekday_label, weekday_label_full)
+            for venue in venues}
+
+async def build_daily_report(venue_name: str, target_date: date, lang: str = "es", tone: str = "funny",
+                             url: Optional[str] = None) -> dict:
+    reports = await build_daily_reports([venue_name], target_date, lang, tone, url)
+    return reports[venue_name]
+
+def report_row(venue_name: str, date_str: str, report: dict) -> dict:
+    """Fila plana del report tal como la guarda /save_report_csv."""
+    return {"date": date_str, "venue": venue_name, **report["kpi_data"], **report["synthetic_data"]}
+
+def has_real_kpis(report: dict) -> bool:
+    """True si kpi_data no lleva valores de relleno de una etapa KPI degradada."""
+    return "kpi_data" in report and not set(report.get("degraded") or ()) & set(KPI_STAGES)
+
+def store_report_snapshots(target_date: date, lang: str, tone: str, reports: dict) -> int:
+    """Guarda como snapshot los reports completos (sin etapas degradadas ni clima de otro día) de {venue: report}."""
+    bodies = {venue: dumps(report) for venue, report in reports.items()
+              if "kpi_data" in report and not report.get("degraded") and not report.get("weather_stale")}
+    return report_snapshots.put_many(target_date.isoformat(), lang, tone, bodies)
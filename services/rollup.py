@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""Modo rollup de los fallbacks CSV: agregados en servidor en vez de filas.
+
+Con `group_by` (cualquier subconjunto de venue, week, month, product) y
+`agg` (sum, mean, min, max; por defecto sum) en los params, los fallbacks de
+reservas, stock y cogs devuelven una fila por grupo con `<medida>_<agg>` y
+`rows` (filas originales agregadas) en vez de las filas diarias.
+
+Se responde desde los cubos precalculados (store.cubes) cuando el rango
+pedido cae en semanas o meses completos; si no (rangos de días sueltos, o
+week y month a la vez) se agregan las filas diarias del rango con el mismo
+código, así que el resultado es idéntico por los dos caminos.
+"""
+
+from datetime import date, timedelta
+from typing import Optional
+
+import pandas as pd
+
+from store.cubes import month_period, row_partials
+from store.datasets import registry as datasets
+
+DIMENSIONS = ("venue", "week", "month", "product")
+AGGREGATIONS = ("sum", "mean", "min", "max")
+
+_EPOCH = date(1970, 1, 1)
+# lunes de la semana ordinal 0 (ver store.datasets)
+_WEEK_EPOCH = date(1969, 12, 29)
+
+def _as_list(value) -> list[str]:
+    if value is None:
+        return []
+    items = value.split(",") if isinstance(value, str) else value
+    if not isinstance(items, (list, tuple)):
+        raise ValueError("group_by y agg deben ser una lista o texto separado por comas")
+    return list(dict.fromkeys(str(v).strip().lower() for v in items if str(v).strip()))
+
+def parse_rollup(params: dict) -> Optional[tuple[list[str], list[str]]]:
+    """(group_by, aggs) si los params piden rollup; None si no."""
+    if params.get("group_by") is None and params.get("agg") is None:
+        return None
+    group_by = _as_list(params.get("group_by"))
+    aggs = _as_list(params.get("agg")) or ["sum"]
+    unknown = [d for d in group_by if d not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"group_by no válido: {', '.join(unknown)} (admitidos: {', '.join(DIMENSIONS)})")
+    unknown = [a for a in aggs if a not in AGGREGATIONS]
+    if unknown:
+        raise ValueError(f"agg no válido: {', '.join(unknown)} (admitidos: {', '.join(AGGREGATIONS)})")
+    return group_by, aggs
+
+def iso_week_ordinal(year: int, week: int) -> int:
+    return ((date.fromisocalendar(year, week, 1) - _EPOCH).days + 3) // 7
+
+def _day(ordinal: int) -> date:
+    return _EPOCH + timedelta(days=ordinal)
+
+def _month_ordinal(d: date) -> int:
+    return d.year * 12 + d.month - 1
+
+def _week_aligned(lo, hi) -> bool:
+    return (lo is None or (lo + 3) % 7 == 0) and (hi is None or (hi + 3) % 7 == 6)
+
+def _month_aligned(lo, hi) -> bool:
+    return (lo is None or _day(lo).day == 1) and (hi is None or _day(hi + 1).day == 1)
+
+def _cube_for(dataset: str, dims: list[str], lo, hi) -> Optional[str]:
+    """Cubo ("week" / "month") que responde el rango de días [lo, hi]; None si hay que ir a las filas."""
+    has_month = "cube_month" in datasets.dataset(dataset).indexes
+    if "month" not in dims and _week_aligned(lo, hi):
+        return "week"
+    if "week" not in dims and has_month and _month_aligned(lo, hi):
+        return "month"
+    return None
+
+def _cube_partials(cube, grain: str, company, venue, lo, hi) -> pd.DataFrame:
+    return cube.slice(company, venue, lo, hi).rename(columns={"period": grain})
+
+def _day_partials(dataset: str, cube, company, venue, lo, hi, dims: list[str]) -> pd.DataFrame:
+    if venue is None:
+        rows = datasets.index(dataset, "by_day").range(company, lo=lo, hi=hi)
+    else:
+        rows = datasets.index(dataset, "by_venue_day").range(company, venue, lo=lo, hi=hi)
+    rows = rows.assign(week=rows["week_ordinal"])
+    if "month" in dims:
+        rows = rows.assign(month=month_period(rows))
+    keys = ["p_venue_name", "week"] + (["month"] if "month" in dims else []) \
+        + ([cube.product] if cube.product else [])
+    return row_partials(rows, keys, cube.measures)
+
+def _combine(parts: pd.DataFrame, keys: list[str], measures: list[str], aggs: list[str]) -> pd.DataFrame:
+    named = {}
+    for m in measures:
+        named[f"{m}__sum"] = (f"{m}__sum", "sum")
+        named[f"{m}__count"] = (f"{m}__count", "sum")
+        named[f"{m}__min"] = (f"{m}__min", "min")
+        named[f"{m}__max"] = (f"{m}__max", "max")
+    if not keys:
+        parts = parts.assign(_all=0)
+    grouped = parts.groupby(keys or ["_all"], observed=True, sort=True).agg(**named).reset_index()
+
+    out = grouped[keys].copy()
+    for m in measures:
+        for a in aggs:
+            if a == "mean":
+                out[f"{m}_mean"] = grouped[f"{m}__sum"] / grouped[f"{m}__count"]
+            else:
+                out[f"{m}_{a}"] = grouped[f"{m}__{a}"]
+    out["rows"] = grouped[f"{measures[0]}__count"]
+    return out
+
+def _label_periods(frame: pd.DataFrame, keys: list[str], dims: list[str]) -> pd.DataFrame:
+    """Sustituye los ordinales de periodo por columnas legibles."""
+    labels = {}
+    if "month" in dims:
+        labels["p_year"] = frame["month"] // 12
+        labels["p_month_number"] = frame["month"] % 12 + 1
+    if "week" in dims:
+        mondays = [_WEEK_EPOCH + timedelta(weeks=int(w)) for w in frame["week"]]
+        iso = [m.isocalendar() for m in mondays]
+        if "month" not in dims:
+            labels["p_year"] = [c.year for c in iso]
+        labels["p_week_number"] = [c.week for c in iso]
+        labels["week_start"] = [m.isoformat() for m in mondays]
+    head = [k for k in keys if k not in ("week", "month")]
+    rest = [c for c in frame.columns if c not in keys]
+    return pd.concat([frame[head], pd.DataFrame(labels, index=frame.index), frame[rest]], axis=1)
+
+def rollup(dataset: str, company, venue, lo, hi, group_by: list[str], aggs: list[str],
+           unit: str = "day") -> pd.DataFrame:
+    """Agregado de `dataset` para la compañía (y venue) en [lo, hi].
+
+    unit="day": lo/hi son ordinales de día (reservas, stock).
+    unit="week": lo/hi son ordinales de semana ISO (sales, que solo tiene semanas).
+    """
+    week_cube = datasets.index(dataset, "cube_week")
+    if "product" in group_by and week_cube.product is None:
+        raise ValueError(f"{dataset} no tiene producto para group_by")
+    if "month" in group_by and "cube_month" not in datasets.dataset(dataset).indexes:
+        raise ValueError(f"{dataset} solo tiene semanas: month no disponible en group_by")
+
+    if unit == "week":
+        parts = _cube_partials(week_cube, "week", company, venue, lo, hi)
+    else:
+        grain = _cube_for(dataset, group_by, lo, hi)
+        if grain == "week":
+            parts = _cube_partials(week_cube, "week", company, venue,
+                                   None if lo is None else (lo + 3) // 7, None if hi is None else (hi + 3) // 7)
+        elif grain == "month":
+            parts = _cube_partials(datasets.index(dataset, "cube_month"), "month", company, venue,
+                                   None if lo is None else _month_ordinal(_day(lo)),
+                                   None if hi is None else _month_ordinal(_day(hi)))
+        else:
+            parts = _day_partials(dataset, week_cube, company, venue, lo, hi, group_by)
+
+    columns = {"venue": "p_venue_name", "week": "week", "month": "month", "product": week_cube.product}
+    keys = [columns[d] for d in DIMENSIONS if d in group_by]
+    return _label_periods(_combine(parts, keys, week_cube.measures, aggs), keys, group_by)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Single-flight para las descargas de clima bajo demanda.
+
+Si varios /daily_report o weather_forecast piden a la vez el mismo clima
+que falta, solo uno llama a Visual Crossing y guarda las filas; el resto
+espera esa misma descarga. La clave es (ciudad normalizada, inicio, fin) y
+una petición cuyo rango cabe dentro de una descarga ya en vuelo para la
+misma ciudad también se une a ella.
+
+La descarga corre en su propia tarea: si el primer llamante se cancela
+(p. ej. por el timeout de su etapa) la descarga sigue y los demás reciben
+el resultado.
+
+Vive en el event loop (sin locks): usar solo desde código async.
+"""
+
+import asyncio
+from datetime import date
+from typing import Optional
+
+from clients.visual_crossing import CITY_ALIAS, fetch_weather_for_city
+from store.weather import upsert_daily_weather_async
+
+def normalize_city(city: str) -> str:
+    """Venue o ciudad -> nombre que se pide a Visual Crossing ('pamplona' -> 'Pamplona, ES')."""
+    city = " ".join(str(city).split())
+    return CITY_ALIAS.get(city.upper(), city)
+
+def _iso(value) -> str:
+    return date.fromisoformat(str(value).strip()[:10]).isoformat()
+
+class WeatherSingleFlight:
+    def __init__(self):
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self.requests = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+
+    def _find_covering(self, city: str, start: str, end: str) -> Optional[tuple]:
+        if (city, start, end) in self._inflight:
+            return (city, start, end)
+        return next((key for key in self._inflight if key[0] == city and key[1] <= start and end <= key[2]), None)
+
+    async def fetch(self, city: str, start_date: str, end_date: Optional[str] = None) -> list[dict]:
+        """Filas de clima de city entre start_date y end_date, descargadas y guardadas una sola vez."""
+        city = normalize_city(city)
+        start = _iso(start_date)
+        end = _iso(end_date) if end_date else start
+        self.requests += 1
+
+        key = self._find_covering(city, start, end)
+        if key is not None:
+            self.coalesced += 1
+            rows = await asyncio.shield(self._inflight[key])
+            return rows if key[1:] == (start, end) else [r for r in rows if start <= r["date"] <= end]
+
+        key = (city, start, end)
+        self.upstream_calls += 1
+        task = asyncio.create_task(self._load(city, start, end))
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: tuple, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # los llamantes ya la reciben; evita el aviso si todos se cancelaron
+
+    async def _load(self, city: str, start: str, end: str) -> list[dict]:
+        rows = await fetch_weather_for_city(city, start, end if end != start else None)
+        await upsert_daily_weather_async(rows)
+        return rows
+
+    def stats(self) -> dict:
+        return {
+            "inflight": len(self._inflight),
+            "requests": self.requests,
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+        }
+
+weather_flight = WeatherSingleFlight()
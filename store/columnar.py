@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Formato binario columnar para los datasets de data/.
+
+Cada CSV registrado se compila a un fichero Arrow IPC (Feather v2, sin
+comprimir) al lado del CSV: `data/synthetic_stock.csv` ->
+`data/synthetic_stock.arrow`. Las columnas se guardan ya tipadas con los
+dtypes del registro y las `category` como diccionario, así que los textos
+repetidos (compañía, venue, producto) se guardan una vez. Al ir sin
+comprimir se lee con memory map: no hay parseo de texto y las columnas
+numéricas salen casi sin copias. Las columnas derivadas del registro
+(day_ordinal / week_ordinal) se guardan también, para no añadirlas al
+cargar copiando el frame.
+
+El registro usa el binario si existe, si pyarrow está instalado y si no es
+más antiguo que el CSV; si no, sigue leyendo el CSV.
+
+Uso:
+    python -m store.columnar            # compila todos los datasets
+    python -m store.columnar stock      # solo los indicados
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # sin pyarrow solo se leen los CSV
+    feather = None
+
+BINARY_SUFFIX = ".arrow"
+
+def binary_path_for(csv_path: str) -> str:
+    return str(Path(csv_path).with_suffix(BINARY_SUFFIX))
+
+def binary_available() -> bool:
+    return feather is not None
+
+def read_binary(path: str) -> pd.DataFrame:
+    table = feather.read_table(path, memory_map=True)
+    return table.to_pandas(split_blocks=True)
+
+def write_binary(frame: pd.DataFrame, path: str):
+    """Escribe el binario en un temporal y lo renombra: quien lee nunca ve un fichero a medias."""
+    tmp = f"{path}.tmp-{os.getpid()}"
+    try:
+        feather.write_feather(frame, tmp, compression="uncompressed")
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def compile_dataset(ds) -> str:
+    """Compila el CSV del dataset `ds` (store.datasets.Dataset) a su binario; devuelve la ruta."""
+    if feather is None:
+        raise RuntimeError("pyarrow no está instalado")
+    t0 = time.perf_counter()
+    frame = ds.with_derived(ds.read_csv())
+    dest = binary_path_for(ds.path)
+    write_binary(frame, dest)
+    csv_size, bin_size = os.path.getsize(ds.path), os.path.getsize(dest)
+    print(f"🗜️ [columnar] {ds.name}: {len(frame)} filas, {csv_size / 1024:.0f} KB -> {bin_size / 1024:.0f} KB "
+          f"en {(time.perf_counter() - t0) * 1000:.0f} ms ({dest})")
+    return dest
+
+def main(names: list[str]) -> int:
+    from store.datasets import registry
+
+    names = names or registry.names()
+    failed = 0
+    for name in names:
+        ds = registry.dataset(name)
+        if not os.path.exists(ds.path):
+            print(f"⚠️ [columnar] {name}: no existe {ds.path}, se omite")
+            continue
+        try:
+            compile_dataset(ds)
+        except Exception as e:
+            failed += 1
+            print(f"❌ [columnar] {name}: {e}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Cubos de agregados precalculados para los rollups de los fallbacks.
+
+Un Cube agrupa un dataset por (compañía, venue, periodo[, producto]) y
+guarda por cada medida su suma, número de filas, mínimo y máximo. Con eso
+cualquier agrupación más gruesa (por venue, por producto, total...) y
+cualquier agregación sum/mean/min/max se obtiene combinando filas del cubo
+en vez de las filas diarias. Se construyen al cargar el dataset, como un
+índice más, y se sustituyen junto con su snapshot.
+
+Los periodos son ordinales: semana ISO como en store.datasets
+(`week_ordinal`) y mes = año * 12 + mes - 1.
+"""
+
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from store.indexes import KeyedIndex
+
+PARTIALS = ("sum", "count", "min", "max")
+
+def week_period(frame: pd.DataFrame) -> pd.Series:
+    if "week_ordinal" in frame.columns:
+        return frame["week_ordinal"]
+    # sin fecha diaria: lunes de la semana ISO (p_year, p_week_number)
+    mondays = pd.to_datetime(frame["p_year"].astype(str) + "-" + frame["p_week_number"].astype(str) + "-1",
+                             format="%G-%V-%u")
+    days = mondays.to_numpy("datetime64[D]").astype(np.int64)
+    return pd.Series((days + 3) // 7, index=frame.index)
+
+def month_period(frame: pd.DataFrame) -> pd.Series:
+    dates = pd.to_datetime(frame["date"])
+    return dates.dt.year * 12 + dates.dt.month - 1
+
+def partials(frame: pd.DataFrame, keys: Sequence[str], measures: Sequence[str]) -> pd.DataFrame:
+    """Agregados parciales por `keys` (columnas `<medida>__sum|count|min|max`)."""
+    return frame.groupby(list(keys), observed=True, sort=False).agg(
+        **{f"{m}__{p}": (m, p) for m in measures for p in PARTIALS}).reset_index()
+
+def row_partials(frame: pd.DataFrame, keys: Sequence[str], measures: Sequence[str]) -> pd.DataFrame:
+    """Cada fila como su propio parcial (para agregar filas sin cubo con el mismo código)."""
+    out = frame[list(keys)].copy()
+    for m in measures:
+        values = frame[m]
+        out[f"{m}__sum"] = values
+        out[f"{m}__count"] = values.notna().astype(np.int64)
+        out[f"{m}__min"] = values
+        out[f"{m}__max"] = values
+    return out
+
+class Cube:
+    def __init__(self, frame: pd.DataFrame, grain: str, period: Callable[[pd.DataFrame], pd.Series],
+                 measures: Sequence[str], product: Optional[str] = None):
+        self.grain = grain
+        self.measures = list(measures)
+        self.product = product
+        keys = ["p_company_name", "p_venue_name"] + ([product] if product else [])
+        work = frame[keys + self.measures].assign(period=period(frame))
+        self.frame = partials(work, keys + ["period"], self.measures)
+        self.by_company = KeyedIndex(self.frame, ("p_company_name",), sort_col="period")
+        self.by_venue = KeyedIndex(self.frame, ("p_company_name", "p_venue_name"), sort_col="period")
+
+    def slice(self, company, venue=None, lo: Optional[int] = None, hi: Optional[int] = None) -> pd.DataFrame:
+        """Filas del cubo de la compañía (y venue) con lo <= periodo <= hi."""
+        if venue is None:
+            return self.by_company.range(company, lo=lo, hi=hi)
+        return self.by_venue.range(company, venue, lo=lo, hi=hi)
+
+    def __len__(self):
+        return len(self.frame)
+
+def cube(grain: str, period: Callable[[pd.DataFrame], pd.Series], measures: Sequence[str],
+         product: Optional[str] = None):
+    """Constructor para `indexes=` del registro."""
+    return lambda frame: Cube(frame, grain, period, measures, product)
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""Registro en memoria de los datasets CSV.
+
+Cada CSV se lee una sola vez con dtypes fijos y se mantiene en memoria; en
+cada acceso se compara mtime/size del fichero y solo se recarga si ha
+cambiado. La recarga construye el DataFrame nuevo completo y después lo
+sustituye de golpe, así que un request nunca ve un dataset a medio leer.
+
+Si al lado del CSV hay un binario columnar compilado (ver store.columnar)
+igual o más reciente, se carga ese en lugar del CSV. Con
+DATASETS_SHARED_DIR (ver store.shared) se carga antes que nada la versión
+publicada para todos los workers.
+
+Los DataFrames devueltos se comparten entre requests: no modificarlos in place.
+"""
+
+import os
+import time
+import threading
+from pathlib import Path
+from datetime import date, datetime
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from store.columnar import binary_available, binary_path_for, read_binary
+from store.cubes import cube, month_period, week_period
+from store.indexes import KeyedIndex
+from store.lookups import EventsIndex, PhraseBook
+from store.shared import shared_dataset_path
+from store.stock_alerts import StockAlerts
+
+#rutas csv sintéticos
+SALES_CSV = "data/synthetic_sales_details.csv"
+CASHFLOW_CSV = "data/synthetic_cash_flow.csv"
+EBITDA_CSV = "data/synthetic_ebitda.csv"
+RESERVAS_CSV = "data/synthetic_reservas.csv"
+STOCK_CSV = "data/synthetic_stock.csv"
+
+EVENTS_CSV = "data/daily_events.csv"
+MOTIVATION_CSV = "data/motivational_phrases.csv"
+
+# datos generados en runtime (clima, reports)
+DATA_DIR = Path("/weather")
+
+class Snapshot:
+    """DataFrame cargado + sus índices + la firma (ruta, mtime, size) del fichero del que sale."""
+
+    __slots__ = ("frame", "indexes", "path", "mtime_ns", "size", "loaded_at", "load_seconds")
+
+    def __init__(self, frame, indexes, path, mtime_ns, size, loaded_at, load_seconds):
+        self.frame = frame
+        self.indexes = indexes
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.loaded_at = loaded_at
+        self.load_seconds = load_seconds
+
+    def matches(self, path: str, st: os.stat_result) -> bool:
+        return self.path == path and self.mtime_ns == st.st_mtime_ns and self.size == st.st_size
+
+def _stat(path: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+class Dataset:
+    def __init__(self, name: str, path: str, dtype: Optional[dict] = None,
+                 indexes: Optional[dict[str, Callable]] = None,
+                 derive: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None, **read_kwargs):
+        self.name = name
+        self.path = path
+        self.binary_path = binary_path_for(path)
+        self.dtype = dtype
+        self.indexes = indexes or {}
+        # columnas calculadas a partir del CSV; los binarios compilados/publicados ya las traen
+        self.derive = derive
+        self.read_kwargs = read_kwargs
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self._snapshot: Optional[Snapshot] = None
+        self._lock = threading.Lock()
+
+    def source(self) -> Optional[tuple[str, os.stat_result]]:
+        """(ruta, stat) del fichero a cargar: la versión compartida publicada si la hay, si no la local."""
+        shared = shared_dataset_path(self.name)
+        if shared is not None:
+            st = _stat(shared)
+            if st is not None:
+                return shared, st
+        return self.local_source()
+
+    def local_source(self) -> Optional[tuple[str, os.stat_result]]:
+        """El binario de data/ si está al día, si no el CSV; None si no hay ninguno."""
+        csv_st = _stat(self.path)
+        if binary_available():
+            bin_st = _stat(self.binary_path)
+            if bin_st is not None and (csv_st is None or bin_st.st_mtime_ns >= csv_st.st_mtime_ns):
+                return self.binary_path, bin_st
+        return None if csv_st is None else (self.path, csv_st)
+
+    def snapshot(self) -> Optional[Snapshot]:
+        """Snapshot actual; None si el fichero no existe."""
+        source = self.source()
+        if source is None:
+            return None
+        path, st = source
+
+        snap = self._snapshot
+        if snap is not None and snap.matches(path, st):
+            self.hits += 1
+            return snap
+
+        with self._lock:
+            # otro thread puede haberlo recargado mientras esperábamos
+            snap = self._snapshot
+            if snap is not None and snap.matches(path, st):
+                self.hits += 1
+                return snap
+            self.misses += 1
+            if snap is not None:
+                self.reloads += 1
+            snap = self._load(path, st)
+            self._snapshot = snap
+            return snap
+
+    def get(self) -> Optional[pd.DataFrame]:
+        snap = self.snapshot()
+        return None if snap is None else snap.frame
+
+    def read_csv(self) -> pd.DataFrame:
+        return pd.read_csv(self.path, dtype=self.dtype, **self.read_kwargs)
+
+    def with_derived(self, frame: pd.DataFrame) -> pd.DataFrame:
+        return frame if self.derive is None else self.derive(frame)
+
+    def _load(self, path: str, st: os.stat_result) -> Snapshot:
+        t0 = time.perf_counter()
+        frame = self.with_derived(self.read_csv() if path == self.path else read_binary(path))
+        indexes = {name: build(frame) for name, build in self.indexes.items()}
+        elapsed = time.perf_counter() - t0
+        print(f"📚 [datasets] {self.name}: {len(frame)} filas cargadas en {elapsed * 1000:.1f} ms ({path})")
+        return Snapshot(frame, indexes, path, st.st_mtime_ns, st.st_size, datetime.now(), elapsed)
+
+    def stats(self) -> dict:
+        snap = self._snapshot
+        return {
+            "path": self.path,
+            "source": None if snap is None else snap.path,
+            "loaded": snap is not None,
+            "rows": None if snap is None else len(snap.frame),
+            "loaded_at": None if snap is None else snap.loaded_at.isoformat(timespec="seconds"),
+            "load_ms": None if snap is None else round(snap.load_seconds * 1000, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+        }
+
+class DatasetRegistry:
+    def __init__(self):
+        self._datasets: dict[str, Dataset] = {}
+
+    def register(self, name: str, path: str, dtype: Optional[dict] = None,
+                 indexes: Optional[dict[str, Callable]] = None,
+                 derive: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None, **read_kwargs) -> Dataset:
+        ds = Dataset(name, path, dtype, indexes, derive, **read_kwargs)
+        self._datasets[name] = ds
+        return ds
+
+    def names(self) -> list[str]:
+        return list(self._datasets)
+
+    def dataset(self, name: str) -> Dataset:
+        return self._datasets[name]
+
+    def get(self, name: str) -> Optional[pd.DataFrame]:
+        """DataFrame del dataset o None si su fichero no existe."""
+        return self._datasets[name].get()
+
+    def index(self, name: str, index_name: str):
+        """Índice `index_name` del snapshot actual; FileNotFoundError si falta el fichero."""
+        ds = self._datasets[name]
+        snap = ds.snapshot()
+        if snap is None:
+            raise FileNotFoundError(ds.path)
+        return snap.indexes[index_name]
+
+    def warm(self):
+        for ds in self._datasets.values():
+            ds.snapshot()
+
+    def stats(self) -> dict:
+        return {name: ds.stats() for name, ds in self._datasets.items()}
+
+def _keyed(*keys, sort_col=None):
+    return lambda frame: KeyedIndex(frame, keys, sort_col)
+
+# Ordinales monótonos entre años: día = días desde 1970-01-01 y semana ISO =
+# semanas (de lunes a domingo) desde el lunes 1969-12-29. p_year es el año
+# natural pero p_week_number la semana ISO (el 2024-12-30 va como 2024 / semana 1),
+# así que los rangos se resuelven siempre sobre la fecha.
+ORDINAL_COLUMNS = ["day_ordinal", "week_ordinal"]
+
+def day_ordinal(d: date) -> int:
+    return (d - date(1970, 1, 1)).days
+
+def _with_ordinals(frame: pd.DataFrame) -> pd.DataFrame:
+    # los binarios ya los llevan: sin assign, que copiaría todas las columnas del frame mapeado
+    if all(c in frame.columns for c in ORDINAL_COLUMNS):
+        return frame
+    days = pd.to_datetime(frame["date"]).to_numpy("datetime64[D]").astype(np.int64)
+    return frame.assign(day_ordinal=days, week_ordinal=(days + 3) // 7)
+
+_KEYS = {"p_company_name": "category", "p_venue_name": "category", "p_year": "int64", "p_week_number": "int64"}
+
+registry = DatasetRegistry()
+registry.register("sales", SALES_CSV, dtype={
+    **_KEYS, "product": "category", "product_total_price": "float64",
+    "quantity": "int64", "product_unitary_price": "float64",
+}, indexes={
+    "by_venue": _keyed("p_company_name", "p_year", "p_venue_name"),
+    "by_week": _keyed("p_company_name", "p_year", "p_week_number"),
+    # sales solo tiene semanas: no hay cubo mensual
+    "cube_week": cube("week", week_period, ["product_total_price", "quantity", "product_unitary_price"],
+                      "product"),
+})
+registry.register("cashflow", CASHFLOW_CSV, dtype={
+    "p_venue_name": "category", "p_year": "int64", "p_week_number": "int64",
+    **{f"{day}_income_predicted": "float64"
+       for day in ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")},
+}, indexes={
+    "by_week": _keyed("p_year", "p_week_number"),
+    "by_venue": _keyed("p_venue_name", "p_year", "p_week_number"),
+})
+registry.register("ebitda", EBITDA_CSV, dtype={
+    "p_company_name": "category", "p_venue_name": "category", "p_year": "int64", "p_month_number": "int64",
+    "ingresos": "float64", "interes": "float64", "impuestos": "float64",
+    "depreciacion": "float64", "amortizacion": "float64", "ebitda": "float64",
+}, indexes={
+    "by_month": _keyed("p_company_name", "p_year", "p_month_number"),
+    "by_venue": _keyed("p_company_name", "p_year", "p_venue_name"),
+})
+# by_day / by_venue_day: tramos por compañía (y venue) ordenados por día, así que
+# cualquier rango de fechas o semanas, aunque cruce años, es un único searchsorted.
+# cube_week / cube_month: agregados para los rollups (ver services.rollup)
+registry.register("reservas", RESERVAS_CSV, dtype={
+    **_KEYS, "date": str, "weekday": "int64", "reservations": "int64",
+}, derive=_with_ordinals, indexes={
+    "by_day": _keyed("p_company_name", sort_col="day_ordinal"),
+    "by_venue_day": _keyed("p_company_name", "p_venue_name", sort_col="day_ordinal"),
+    "cube_week": cube("week", week_period, ["reservations"]),
+    "cube_month": cube("month", month_period, ["reservations"]),
+})
+registry.register("stock", STOCK_CSV, dtype={
+    **_KEYS, "date": str, "weekday": "int64", "product_code": "category",
+    "product_name": "category", "stock": "int64", "capacity": "int64",
+}, derive=_with_ordinals, indexes={
+    "by_day": _keyed("p_company_name", sort_col="day_ordinal"),
+    "by_venue_day": _keyed("p_company_name", "p_venue_name", sort_col="day_ordinal"),
+    "cube_week": cube("week", week_period, ["stock", "capacity"], "product_name"),
+    "cube_month": cube("month", month_period, ["stock", "capacity"], "product_name"),
+    # ratio stock / capacity y nivel de alerta de todas las filas (ver store.stock_alerts)
+    "alerts": StockAlerts,
+})
+# eventos y frases se leen como texto: las nacionales vienen con city vacía.
+# lookup: tablas por (fecha, ciudad) y por (lang, tone), ver store.lookups
+registry.register("events", EVENTS_CSV, dtype=str, keep_default_na=False, indexes={"lookup": EventsIndex})
+registry.register("motivation", MOTIVATION_CSV, dtype=str, keep_default_na=False, indexes={"lookup": PhraseBook})
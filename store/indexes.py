@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Índices por clave para los datasets del registro.
+
+Un KeyedIndex calcula una vez el orden de las filas por (keys..., sort_col)
+y guarda, para cada tupla de claves, el tramo [start, stop) de ese orden
+que le corresponde. Una búsqueda es un acceso a dict y un rango sobre
+`sort_col` es un searchsorted dentro de ese tramo: O(1) + O(log n), sin
+máscaras booleanas sobre todo el dataset.
+
+El índice no copia el DataFrame: guarda las posiciones de fila en ese orden
+(y la columna sort_col ya ordenada para el searchsorted) y cada consulta
+toma solo sus filas del frame original, que con los datasets compartidos
+(store.shared) sigue siendo el Arrow mapeado en memoria. Si el frame ya
+viene en el orden del índice no guarda ni las posiciones y las consultas
+son slices directos.
+"""
+
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+class KeyedIndex:
+    def __init__(self, frame: pd.DataFrame, keys: Sequence[str], sort_col: Optional[str] = None):
+        self.keys = tuple(keys)
+        self.sort_col = sort_col
+        self.frame = frame
+        order_cols = list(self.keys) + ([sort_col] if sort_col else [])
+        positions = frame[order_cols].reset_index(drop=True).sort_values(order_cols, kind="stable").index
+        rows = positions.to_numpy(dtype=np.int64)
+        # None = el frame ya está en el orden del índice
+        self.rows = None if np.array_equal(rows, np.arange(len(rows))) else rows
+        self.sort_values = self._column(sort_col) if sort_col else None
+        self.slices = self._build_slices()
+
+    def _column(self, name: str) -> np.ndarray:
+        values = self.frame[name].to_numpy()
+        return values if self.rows is None else values[self.rows]
+
+    def _build_slices(self) -> dict:
+        n = len(self.frame)
+        if n == 0:
+            return {}
+        columns = [self._column(k).astype(object) for k in self.keys]
+        change = np.zeros(n, dtype=bool)
+        change[0] = True
+        for values in columns:
+            change[1:] |= values[1:] != values[:-1]
+        starts = np.flatnonzero(change)
+        stops = np.append(starts[1:], n)
+        key_rows = zip(*(values[starts].tolist() for values in columns))
+        return {key: (int(start), int(stop)) for key, start, stop in zip(key_rows, starts, stops)}
+
+    def _slice(self, key) -> tuple[int, int]:
+        return self.slices.get(tuple(key), (0, 0))
+
+    def _take(self, start: int, stop: int) -> pd.DataFrame:
+        if self.rows is None:
+            return self.frame.iloc[start:stop]
+        return self.frame.take(self.rows[start:stop])
+
+    def get(self, *key) -> pd.DataFrame:
+        """Filas con exactamente esa tupla de claves."""
+        return self._take(*self._slice(key))
+
+    def range(self, *key, lo=None, hi=None) -> pd.DataFrame:
+        """Filas de la clave con lo <= sort_col <= hi (extremos opcionales)."""
+        start, stop = self._slice(key)
+        if start == stop or (lo is None and hi is None):
+            return self._take(start, stop)
+        values = self.sort_values[start:stop]
+        left = start + (int(np.searchsorted(values, lo, side="left")) if lo is not None else 0)
+        right = start + (int(np.searchsorted(values, hi, side="right")) if hi is not None else stop - start)
+        return self._take(left, max(left, right))
+
+    def __len__(self):
+        return len(self.slices)
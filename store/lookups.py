@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Tablas de consulta de eventos y frases motivacionales, construidas al cargar.
+
+EventsIndex: eventos por (fecha, ciudad normalizada) para el día exacto y
+por ciudad ordenados por fecha para rangos. La ciudad se normaliza como en
+el weather store (venue canónico: 'Vitoria-Gasteiz' -> 'VITORIA'); los
+eventos nacionales van con ciudad "".
+
+PhraseBook: frases por (lang, tone) y una "frase del día" determinista
+(sha1 de fecha|lang|tone, no el hash() de Python, que cambia por proceso),
+así que todos los workers y reinicios dan la misma frase para el mismo día.
+"""
+
+import hashlib
+from datetime import date, timedelta
+from typing import Iterable, Optional
+
+import pandas as pd
+
+from clients.visual_crossing import venue_for_city
+from store.indexes import KeyedIndex
+
+NATIONAL = ""
+
+def city_key(city: Optional[str]) -> str:
+    """Venue canónico de la ciudad, o el nombre en mayúsculas si no es de ningún venue; "" = nacional."""
+    name = " ".join(str(city or "").split())
+    if not name:
+        return NATIONAL
+    return venue_for_city(name) or name.upper()
+
+class EventsIndex:
+    def __init__(self, frame: pd.DataFrame):
+        self.columns = list(frame.columns)
+        keyed = frame.assign(city_key=[city_key(c) for c in frame["city"]])
+        self.by_day = KeyedIndex(keyed, ("date", "city_key"))
+        self.by_city = KeyedIndex(keyed, ("city_key",), sort_col="date")
+
+    def cities(self) -> list[str]:
+        return [key for (key,) in self.by_city.slices if key != NATIONAL]
+
+    def on(self, date_str: str, city: Optional[str] = None) -> pd.DataFrame:
+        """Eventos del día de la ciudad (nacionales si city es None o vacía)."""
+        return self.by_day.get(date_str, city_key(city))[self.columns]
+
+    def between(self, start: str, end: str, cities: Optional[Iterable[str]] = None,
+                national: bool = True) -> pd.DataFrame:
+        """Eventos con start <= date <= end de las ciudades (todas si None), más los nacionales."""
+        keys = self.cities() if cities is None else list(dict.fromkeys(city_key(c) for c in cities))
+        if national and NATIONAL not in keys:
+            keys.append(NATIONAL)
+        parts = [self.by_city.range(key, lo=start, hi=end) for key in keys]
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return pd.DataFrame(columns=self.columns)
+        rows = pd.concat(parts, ignore_index=True)
+        return rows.sort_values(["date", "city_key"], kind="stable")[self.columns]
+
+def _phrase_slot(date_str: str, lang: str, tone: str, n: int) -> int:
+    digest = hashlib.sha1(f"{date_str}|{lang}|{tone}".encode()).digest()
+    return int.from_bytes(digest[:8], "big") % n
+
+class PhraseBook:
+    def __init__(self, frame: pd.DataFrame):
+        self.rows = frame.to_dict("records")
+        self.groups: dict[tuple[str, str], list[dict]] = {}
+        for row in self.rows:
+            self.groups.setdefault((row["lang"].lower(), row["tone"].lower()), []).append(row)
+
+    def phrases(self, lang: str, tone: str) -> list[dict]:
+        """Frases de (lang, tone); todas si no hay ninguna con ese idioma y tono."""
+        return self.groups.get((lang.lower(), tone.lower())) or self.rows
+
+    def pick(self, date_str: str, lang: str, tone: str) -> Optional[dict]:
+        """Frase del día: la misma para la misma fecha, idioma y tono en cualquier proceso."""
+        phrases = self.phrases(lang, tone)
+        if not phrases:
+            return None
+        return phrases[_phrase_slot(date_str, lang.lower(), tone.lower(), len(phrases))]
+
+    def between(self, start: date, end: date, lang: str, tone: str) -> list[dict]:
+        """Frase de cada día entre start y end, con su fecha."""
+        days = (start + timedelta(days=i) for i in range((end - start).days + 1))
+        return [{"date": d.isoformat(), **phrase} for d in days
+                if (phrase := self.pick(d.isoformat(), lang, tone)) is not None]
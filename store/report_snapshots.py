@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Snapshots de daily reports ya calculados, en SQLite.
+
+Clave primaria (venue, date, lang, tone) y el report guardado como el JSON
+que se devuelve, así que servir uno es una lectura por clave sin volver a
+serializar. Los genera el job de ingest.report_snapshots fuera de horas y
+/daily_report los sirve; un snapshot con más de REPORT_SNAPSHOT_MAX_AGE_HOURS
+cuenta como fallo y se recalcula en vivo.
+
+La tabla report_snapshot_runs reparte las ejecuciones programadas entre
+workers: solo el que inserta primero la clave del día la ejecuta.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Optional
+
+from store.datasets import DATA_DIR
+
+REPORTS_DB = os.getenv("REPORTS_DB", str(DATA_DIR / "reports.sqlite3"))
+REPORT_SNAPSHOT_MAX_AGE_HOURS = float(os.getenv("REPORT_SNAPSHOT_MAX_AGE_HOURS", "48"))
+REPORT_SNAPSHOT_KEEP_DAYS = int(os.getenv("REPORT_SNAPSHOT_KEEP_DAYS", "7"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS report_snapshots (
+    venue TEXT, date TEXT, lang TEXT, tone TEXT,
+    report BLOB, built_at TEXT,
+    PRIMARY KEY (venue, date, lang, tone)
+);
+CREATE TABLE IF NOT EXISTS report_snapshot_runs (
+    run_key TEXT PRIMARY KEY, started_at TEXT, finished_at TEXT, reports INTEGER
+);
+"""
+
+_UPSERT = (
+    "INSERT INTO report_snapshots (venue, date, lang, tone, report, built_at) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(venue, date, lang, tone) DO UPDATE SET report = excluded.report, built_at = excluded.built_at"
+)
+
+class ReportSnapshotStore:
+    def __init__(self, path: str = REPORTS_DB):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def connect(self) -> sqlite3.Connection:
+        """Conexión SQLite del thread actual (con el esquema ya creado)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def write(self):
+        conn = self.connect()
+        with self._write_lock, conn:
+            yield conn
+
+    def put_many(self, date_str: str, lang: str, tone: str, reports: dict[str, bytes]) -> int:
+        """Guarda {venue: JSON del report} de una fecha en una transacción."""
+        if not reports:
+            return 0
+        now = datetime.now().isoformat(timespec="seconds")
+        with self.write() as conn:
+            conn.executemany(_UPSERT, [(venue, date_str, lang.lower(), tone.lower(), body, now)
+                                       for venue, body in reports.items()])
+        return len(reports)
+
+    def get(self, venue: str, date_str: str, lang: str, tone: str) -> Optional[tuple[bytes, str]]:
+        """(JSON del report, built_at) si hay un snapshot vigente; None si no."""
+        row = self.connect().execute(
+            "SELECT report, built_at FROM report_snapshots WHERE venue = ? AND date = ? AND lang = ? AND tone = ?",
+            (venue, date_str, lang.lower(), tone.lower())).fetchone()
+        max_age = timedelta(hours=REPORT_SNAPSHOT_MAX_AGE_HOURS)
+        if row is None or datetime.now() - datetime.fromisoformat(row["built_at"]) > max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return bytes(row["report"]), row["built_at"]
+
+    def prune(self, before_date: str) -> int:
+        with self.write() as conn:
+            return conn.execute("DELETE FROM report_snapshots WHERE date < ?", (before_date,)).rowcount
+
+    # --- ejecuciones programadas ---
+
+    def claim_run(self, run_key: str) -> bool:
+        """True si este proceso es el primero en reclamar la ejecución run_key."""
+        with self.write() as conn:
+            cur = conn.execute("INSERT OR IGNORE INTO report_snapshot_runs (run_key, started_at) VALUES (?, ?)",
+                               (run_key, datetime.now().isoformat(timespec="seconds")))
+            return cur.rowcount == 1
+
+    def finish_run(self, run_key: str, reports: int):
+        with self.write() as conn:
+            conn.execute("UPDATE report_snapshot_runs SET finished_at = ?, reports = ? WHERE run_key = ?",
+                         (datetime.now().isoformat(timespec="seconds"), reports, run_key))
+
+    def stats(self) -> dict:
+        conn = self.connect()
+        dates = {row[0]: row[1] for row in conn.execute(
+            "SELECT date, COUNT(*) FROM report_snapshots GROUP BY date ORDER BY date")}
+        last_run = conn.execute("SELECT * FROM report_snapshot_runs ORDER BY started_at DESC LIMIT 1").fetchone()
+        return {
+            "path": self.path,
+            "snapshots_by_date": dates,
+            "last_run": dict(last_run) if last_run else None,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+report_snapshots = ReportSnapshotStore()
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""Almacén de daily reports generados (CSV append-only en /weather)."""
+
+import os
+import csv
+import threading
+
+from store.datasets import DATA_DIR
+
+REPORTS_CSV = str(DATA_DIR / "daily_reports.csv")
+
+_write_lock = threading.Lock()
+
+def append_reports(rows: list[dict]) -> int:
+    """Añade las filas al CSV de reports (crea cabeceras si el fichero no existe)."""
+    if not rows:
+        return 0
+    with _write_lock:
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        file_exists = os.path.exists(REPORTS_CSV)
+        with open(REPORTS_CSV, "a", newline="", encoding="utf-8") as csvfile:
+            for row in rows:
+                writer = csv.DictWriter(csvfile, fieldnames=row.keys())
+                if not file_exists:
+                    writer.writeheader()
+                    file_exists = True
+                writer.writerow(row)
+    return len(rows)
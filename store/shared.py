@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Datasets compartidos entre workers (uvicorn/gunicorn con varios procesos).
+
+Un proceso publicador vuelca todos los datasets en formato columnar
+(store.columnar) a un directorio versionado dentro de DATASETS_SHARED_DIR
+(lo normal es un tmpfs como /dev/shm) y mueve el enlace `current` a la
+versión nueva con un rename atómico:
+
+    DATASETS_SHARED_DIR/
+        v20250303T101500123456/   sales.arrow, stock.arrow, ..., manifest.json
+        current -> v20250303T101500123456
+
+Los workers, con la misma DATASETS_SHARED_DIR, cargan `current/<nombre>.arrow`
+con memory map en vez de leer el CSV: las páginas del fichero las comparte
+el sistema operativo entre procesos, así que las columnas numéricas y los
+códigos de las categorías no se duplican por worker. Como la ruta cargada
+incluye la versión, en cuanto `current` cambia el siguiente acceso recarga
+la versión nueva entera; las versiones viejas se borran cuando hay más de
+DATASETS_SHARED_KEEP (un worker que aún tenga mapeada una borrada la sigue
+leyendo sin problema).
+
+Uso:
+    python -m store.shared                 # publica una versión
+    python -m store.shared --watch 30      # republica cuando cambia un CSV/binario
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+from datetime import datetime
+from typing import Optional
+
+from store.columnar import binary_available, read_binary, write_binary
+
+DATASETS_SHARED_DIR = os.getenv("DATASETS_SHARED_DIR", "").strip() or None
+DATASETS_SHARED_KEEP = int(os.getenv("DATASETS_SHARED_KEEP", "2"))
+
+CURRENT = "current"
+MANIFEST = "manifest.json"
+
+def current_version(shared_dir: Optional[str] = DATASETS_SHARED_DIR) -> Optional[str]:
+    if not shared_dir:
+        return None
+    try:
+        return os.readlink(os.path.join(shared_dir, CURRENT))
+    except OSError:
+        return None
+
+def shared_dataset_path(name: str) -> Optional[str]:
+    """Ruta del dataset en la versión publicada actual (None si no hay modo compartido o versión)."""
+    version = current_version()
+    if version is None:
+        return None
+    return os.path.join(DATASETS_SHARED_DIR, version, f"{name}.arrow")
+
+def read_manifest(shared_dir: Optional[str] = DATASETS_SHARED_DIR) -> Optional[dict]:
+    version = current_version(shared_dir)
+    if version is None:
+        return None
+    try:
+        with open(os.path.join(shared_dir, version, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# --- publicador ---
+
+def _local_signature(registry) -> dict:
+    """{dataset: [ruta, mtime_ns, size]} de los ficheros locales de los que se publica."""
+    signature = {}
+    for name in registry.names():
+        source = registry.dataset(name).local_source()
+        if source is not None:
+            path, st = source
+            signature[name] = [path, st.st_mtime_ns, st.st_size]
+    return signature
+
+def _switch_current(shared_dir: str, version: str):
+    tmp_link = os.path.join(shared_dir, f".{CURRENT}-{os.getpid()}")
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(version, tmp_link)
+    os.replace(tmp_link, os.path.join(shared_dir, CURRENT))
+
+def _cleanup(shared_dir: str, keep: int):
+    current = current_version(shared_dir)
+    versions = sorted(d for d in os.listdir(shared_dir)
+                      if d.startswith("v") and os.path.isdir(os.path.join(shared_dir, d)))
+    for version in versions[:-keep] if keep > 0 else versions:
+        if version != current:
+            shutil.rmtree(os.path.join(shared_dir, version), ignore_errors=True)
+
+def publish(shared_dir: Optional[str] = DATASETS_SHARED_DIR, keep: int = DATASETS_SHARED_KEEP) -> str:
+    """Publica todos los datasets como una versión nueva y la activa; devuelve la versión."""
+    from store.datasets import registry
+
+    if not shared_dir:
+        raise RuntimeError("DATASETS_SHARED_DIR no configurado")
+    if not binary_available():
+        raise RuntimeError("pyarrow no está instalado")
+
+    t0 = time.perf_counter()
+    os.makedirs(shared_dir, exist_ok=True)
+    version = datetime.now().strftime("v%Y%m%dT%H%M%S%f")
+    tmp_dir = os.path.join(shared_dir, f".{version}.tmp")
+    os.makedirs(tmp_dir)
+    try:
+        signature = _local_signature(registry)
+        rows = {}
+        for name, (path, _, _) in signature.items():
+            ds = registry.dataset(name)
+            frame = ds.with_derived(read_binary(path) if path == ds.binary_path else ds.read_csv())
+            write_binary(frame, os.path.join(tmp_dir, f"{name}.arrow"))
+            rows[name] = len(frame)
+        with open(os.path.join(tmp_dir, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump({"version": version, "published_at": datetime.now().isoformat(timespec="seconds"),
+                       "rows": rows, "sources": signature}, f, indent=2)
+        os.rename(tmp_dir, os.path.join(shared_dir, version))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    _switch_current(shared_dir, version)
+    _cleanup(shared_dir, keep)
+    print(f"📤 [shared] Publicada {version}: {len(rows)} datasets en {(time.perf_counter() - t0) * 1000:.0f} ms")
+    return version
+
+def watch(interval: float, shared_dir: Optional[str] = DATASETS_SHARED_DIR):
+    """Publica al arrancar si hace falta y después cada vez que cambia un fichero de origen."""
+    from store.datasets import registry
+
+    while True:
+        manifest = read_manifest(shared_dir)
+        if manifest is None or manifest.get("sources") != _local_signature(registry):
+            try:
+                publish(shared_dir)
+            except Exception as e:
+                print(f"❌ [shared] Error publicando datasets: {e}")
+        time.sleep(interval)
+
+def main(argv: list[str]) -> int:
+    if argv[:1] == ["--watch"]:
+        watch(float(argv[1]) if len(argv) > 1 else 30)
+        return 0
+    publish()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
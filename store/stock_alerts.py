@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Tabla de alertas de stock precalculada.
+
+Al cargar synthetic_stock.csv se calcula en una pasada vectorizada el ratio
+stock / capacity y su nivel ("bajo" < STOCK_ALERT_LOW, "medio" <
+STOCK_ALERT_MEDIUM) para todas las filas (compañía, venue, fecha, producto),
+y se indexa por (compañía, venue) ordenado por día. Un rango de fechas de
+un venue es un searchsorted; con umbrales distintos de los por defecto el
+nivel se recalcula solo sobre ese tramo.
+"""
+
+import os
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from store.indexes import KeyedIndex
+
+STOCK_ALERT_LOW = float(os.getenv("STOCK_ALERT_LOW", "0.3"))
+STOCK_ALERT_MEDIUM = float(os.getenv("STOCK_ALERT_MEDIUM", "0.6"))
+
+LEVELS = ("bajo", "medio")
+COLUMNS = ["p_company_name", "p_venue_name", "date", "product_code", "product_name",
+           "stock", "capacity", "ratio", "level"]
+
+def alert_levels(ratio: np.ndarray, low: float, medium: float) -> np.ndarray:
+    """Nivel por fila: "bajo", "medio" o None (sin alerta, o capacity 0)."""
+    return np.select([ratio < low, ratio < medium], list(LEVELS), default=None)
+
+class StockAlerts:
+    def __init__(self, frame: pd.DataFrame):
+        stock = frame["stock"].to_numpy(dtype=float)
+        capacity = frame["capacity"].to_numpy(dtype=float)
+        ratio = np.divide(stock, capacity, out=np.full(len(frame), np.nan), where=capacity > 0)
+        table = frame[["p_company_name", "p_venue_name", "date", "day_ordinal", "product_code", "product_name",
+                       "stock", "capacity"]].assign(ratio=ratio, level=alert_levels(ratio, STOCK_ALERT_LOW,
+                                                                                   STOCK_ALERT_MEDIUM))
+        self.index = KeyedIndex(table, ("p_company_name", "p_venue_name"), sort_col="day_ordinal")
+
+    def venues(self, company) -> list[str]:
+        return [venue for (c, venue) in self.index.slices if c == company]
+
+    def rows(self, company, venues: Optional[Iterable[str]] = None, lo: Optional[int] = None,
+             hi: Optional[int] = None, low: float = STOCK_ALERT_LOW,
+             medium: float = STOCK_ALERT_MEDIUM) -> pd.DataFrame:
+        """Filas con alerta de los venues (todos si None) con lo <= día <= hi."""
+        venues = self.venues(company) if venues is None else list(venues)
+        parts = [self.index.range(company, venue, lo=lo, hi=hi) for venue in venues]
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return pd.DataFrame(columns=COLUMNS)
+        rows = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+        if (low, medium) != (STOCK_ALERT_LOW, STOCK_ALERT_MEDIUM):
+            rows = rows.assign(level=alert_levels(rows["ratio"].to_numpy(), low, medium))
+        return rows.loc[rows["level"].notna(), COLUMNS]
+
+    def buckets(self, company, venues: list[str], lo: int, hi: int) -> dict:
+        """{venue: ([productos bajo], [productos medio])} con los umbrales por defecto."""
+        result = {venue: ([], []) for venue in venues}
+        rows = self.rows(company, venues, lo, hi)
+        for venue, product, level in zip(rows["p_venue_name"].astype(str), rows["product_name"].astype(str),
+                                         rows["level"]):
+            result[venue][LEVELS.index(level)].append(product)
+        return result
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Almacén de clima diario en SQLite con clave primaria (city, date).
+
+Sustituye al CSV /weather/daily_weather.csv: los upserts van por lotes en
+una sola transacción (INSERT ... ON CONFLICT) en vez de reescribir el
+fichero entero por fila, y las lecturas puntuales o por rango de fechas
+usan la clave primaria / el índice por fecha. WAL permite leer mientras
+otro ingest escribe.
+
+Cada fila lleva su venue canónico (PAMPLONA, BILBAO...) calculado al
+guardarla, y las lecturas por (venue, fecha) salen de un índice en memoria
+que se reconstruye solo cuando el contador `generation` de weather_meta
+cambia (lo sube cada upsert, también los de otros procesos).
+"""
+
+import os
+import csv
+import sqlite3
+import asyncio
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from clients.visual_crossing import venue_for_city, venue_key
+from store.datasets import DATA_DIR
+
+WEATHER_DB = os.getenv("WEATHER_DB", str(DATA_DIR / "weather.sqlite3"))
+WEATHER_CSV = DATA_DIR / "daily_weather.csv"
+
+# columns we need
+WEATHER_COLUMNS = [
+    "city","date","tempmax","tempmin","temp",
+    "feelslikemax","feelslikemin","feelslike",
+    "precip","precipprob","conditions","icon","source"
+]
+
+# venue: venue canónico de la ciudad
+# fetched_at: cuándo se descargó la fila (para saber si una previsión está caducada)
+STORE_COLUMNS = WEATHER_COLUMNS + ["venue", "fetched_at"]
+
+_TEXT_COLUMNS = {"city", "date", "conditions", "icon", "source", "venue", "fetched_at"}
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS weather_daily (
+    {", ".join(f"{c} {'TEXT' if c in _TEXT_COLUMNS else 'REAL'}" for c in STORE_COLUMNS)},
+    PRIMARY KEY (city, date)
+);
+CREATE INDEX IF NOT EXISTS ix_weather_daily_date ON weather_daily (date);
+CREATE TABLE IF NOT EXISTS weather_meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_BUMP_GENERATION = (
+    "INSERT INTO weather_meta (key, value) VALUES ('generation', '1') "
+    "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+)
+
+_UPSERT = (
+    f"INSERT INTO weather_daily ({', '.join(STORE_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(STORE_COLUMNS))}) "
+    f"ON CONFLICT(city, date) DO UPDATE SET "
+    + ", ".join(f"{c} = excluded.{c}" for c in STORE_COLUMNS if c not in ("city", "date"))
+)
+
+def _like_pattern(text: str) -> str:
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+class WeatherStore:
+    def __init__(self, path: str = WEATHER_DB):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        # (venue, date) -> fila; se reconstruye cuando cambia la generación
+        self._index: dict[tuple[str, str], dict] = {}
+        self._index_generation: Optional[int] = None
+        self._index_lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        """Conexión SQLite del thread actual (con el esquema ya creado)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(_SCHEMA)
+                    self._migrate(conn)
+                    self._schema_ready = True
+        return conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(weather_daily)")}
+        with conn:
+            if "fetched_at" not in columns:
+                conn.execute("ALTER TABLE weather_daily ADD COLUMN fetched_at TEXT")
+            if "venue" not in columns:
+                conn.execute("ALTER TABLE weather_daily ADD COLUMN venue TEXT")
+                cities = [row[0] for row in conn.execute("SELECT DISTINCT city FROM weather_daily")]
+                conn.executemany("UPDATE weather_daily SET venue = ? WHERE city = ?",
+                                 [(venue_for_city(city), city) for city in cities])
+                conn.execute(_BUMP_GENERATION)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_weather_daily_venue_date ON weather_daily (venue, date)")
+
+    @contextmanager
+    def write(self):
+        """Transacción de escritura serializada entre threads."""
+        conn = self.connect()
+        with self._write_lock, conn:
+            yield conn
+
+    # --- escrituras ---
+
+    def upsert_many(self, rows: list[dict]) -> int:
+        """Upsert por (city, date) de todas las filas en una transacción."""
+        if not rows:
+            return 0
+        now = datetime.now().isoformat(timespec="seconds")
+        values = [tuple(row.get(c) for c in WEATHER_COLUMNS)
+                  + (row.get("venue") or venue_for_city(row.get("city")), row.get("fetched_at", now))
+                  for row in rows]
+        with self.write() as conn:
+            conn.executemany(_UPSERT, values)
+            conn.execute(_BUMP_GENERATION)
+        print(f"✅ [weather_store] Upsert de {len(values)} filas")
+        return len(values)
+
+    def import_csv(self, csv_path=WEATHER_CSV) -> int:
+        """Importa el CSV antiguo de clima (una sola vez; devuelve filas importadas)."""
+        conn = self.connect()
+        if conn.execute("SELECT 1 FROM weather_meta WHERE key = 'csv_imported'").fetchone():
+            return 0
+        rows = []
+        if os.path.exists(csv_path):
+            with open(csv_path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    if not row.get("city") or not row.get("date"):
+                        continue
+                    rows.append({c: (row.get(c) if row.get(c) != "" else None) for c in WEATHER_COLUMNS}
+                                | {"fetched_at": None})
+        imported = self.upsert_many(rows)
+        with self.write() as conn:
+            conn.execute("INSERT OR REPLACE INTO weather_meta (key, value) VALUES ('csv_imported', ?)",
+                         (str(csv_path),))
+        print(f"📦 [weather_store] Importadas {imported} filas desde {csv_path}")
+        return imported
+
+    # --- lecturas ---
+
+    def _fetch(self, sql: str, args=()) -> list[dict]:
+        return [dict(row) for row in self.connect().execute(sql, args).fetchall()]
+
+    def search(self, city: str, start_date: str, end_date: Optional[str] = None) -> list[dict]:
+        """Filas cuya city contiene `city` (sin mayúsculas) entre start_date y end_date."""
+        return self._fetch(
+            "SELECT * FROM weather_daily WHERE date BETWEEN ? AND ? AND city LIKE ? ESCAPE '\\' "
+            "ORDER BY date, city",
+            (start_date, end_date or start_date, _like_pattern(city)))
+
+    def last_known(self, venue: str, date_str: str) -> Optional[dict]:
+        """Fila más reciente del venue en o antes de date_str."""
+        rows = self._fetch(
+            "SELECT * FROM weather_daily WHERE venue = ? AND date <= ? "
+            "ORDER BY date DESC, fetched_at DESC LIMIT 1",
+            (venue_for_city(venue) or venue, date_str))
+        return rows[0] if rows else None
+
+    def fetched_dates(self, venue: str, start_date: str, end_date: str) -> dict[str, Optional[str]]:
+        """{date: fetched_at} del venue en el rango (la descarga más reciente si hay varias grafías de ciudad)."""
+        key = venue_for_city(venue)
+        rows = self.connect().execute(
+            "SELECT date, MAX(fetched_at) AS fetched_at FROM weather_daily "
+            f"WHERE {'venue' if key else 'city'} = ? AND date BETWEEN ? AND ? GROUP BY date",
+            (key or venue, start_date, end_date)).fetchall()
+        return {row["date"]: row["fetched_at"] for row in rows}
+
+    # --- índice (venue, date) en memoria ---
+
+    def _generation(self) -> int:
+        row = self.connect().execute("SELECT value FROM weather_meta WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _current_index(self) -> dict[tuple[str, str], dict]:
+        generation = self._generation()
+        if generation != self._index_generation:
+            with self._index_lock:
+                if generation != self._index_generation:
+                    index = {}
+                    # ciudades sin venue van por su nombre normalizado ('MADRID')
+                    # NULL (CSV antiguo) primero: a igual (venue, date) gana la descarga más reciente
+                    for row in self._fetch("SELECT * FROM weather_daily ORDER BY fetched_at"):
+                        key = row["venue"] or venue_key(row["city"])
+                        if key:
+                            index[(key, row["date"])] = row
+                    self._index, self._index_generation = index, generation
+        return self._index
+
+    def lookup(self, venue: str, date_str: str) -> Optional[dict]:
+        """Fila del venue (o de la ciudad, sea o no de un venue) en date_str; O(1) sobre el índice."""
+        return self._current_index().get((venue_key(venue), date_str))
+
+    def lookup_range(self, venues: list[str], start_date: str, end_date: str) -> list[dict]:
+        """Filas de varios venues entre start_date y end_date, por fecha y venue."""
+        index = self._current_index()
+        keys = [venue_key(v) for v in venues]
+        start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+        days = [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+        return [index[(venue, day)] for day in days for venue in keys if (venue, day) in index]
+
+weather_store = WeatherStore()
+
+async def upsert_daily_weather_async(rows: list[dict]) -> int:
+    return await asyncio.to_thread(weather_store.upsert_many, rows)
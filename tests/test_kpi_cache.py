@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from services.kpi_cache import KpiResultCache
+
+def test_leader_timeout_does_not_cancel_followers():
+    async def scenario():
+        cache = KpiResultCache()
+        calls = 0
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return [{"venue_name": "PAMPLONA"}]
+
+        key = ("fn_weekly_venues_income", ("PALLAPIZZA", 15, 2024))
+        leader = asyncio.create_task(asyncio.wait_for(cache.get_or_load(key, 60, loader), 0.01))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.get_or_load(key, 60, loader))
+        leader_result, follower_result = await asyncio.gather(leader, follower, return_exceptions=True)
+        return cache, calls, leader_result, follower_result, await cache.get_or_load(key, 60, loader)
+
+    cache, calls, leader_result, follower_result, cached = asyncio.run(scenario())
+    assert isinstance(leader_result, asyncio.TimeoutError)
+    assert follower_result == [{"venue_name": "PAMPLONA"}]
+    # la carga terminó y quedó en caché aunque el primer llamante se cancelara
+    assert cached == follower_result
+    assert calls == 1
+    assert cache.stats()["inflight"] == 0
+
+def test_loader_error_reaches_every_caller():
+    async def scenario():
+        cache = KpiResultCache()
+
+        async def loader():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("DWH caído")
+
+        key = ("fn_week_total_attendees", ("PALLAPIZZA", 15, 2024))
+        results = await asyncio.gather(*(cache.get_or_load(key, 60, loader) for _ in range(3)),
+                                       return_exceptions=True)
+        return cache, results
+
+    cache, results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert cache.stats()["entries"] == 0 and cache.stats()["inflight"] == 0